@@ -1,44 +1,23 @@
 #! /usr/bin/env python3
 
-import hashlib
-import json
 import sys
 import argparse
 from pathlib import Path
-from typing import List, Dict
+
+sys.path.append(str(Path(__file__).parent / "src"))
+from utils import data_utils  # noqa: E402
 
 
 parser = argparse.ArgumentParser(description="Add hash id to json")
 parser.add_argument("--path", type=Path, nargs="+", help="file path or folder path to json object(s)")
+parser.add_argument("--workers", type=int, default=4, help="number of processes normalising files in parallel")
 args = parser.parse_args()
 path = args.path[0]
 
 
-def add_id(lst_dct: List[dict]):
-    for dct in lst_dct:
-        dct["id"] = hashlib.md5(str(dct).encode("utf-8")).hexdigest()
-        if isinstance(dct["text"], list):
-            dct["text"] = "\n\n".join(dct["text"])
-    return lst_dct
-
-
-def process_file(path: Path):
-    try:
-        lst_dct = [json.loads(line) for line in open(path, "r").read().split("\n") if line]
-        lst_dct = add_id(lst_dct)
-        # path.rename(path.with_suffix(".jl"))
-        with open(path, "w") as jsonl_file:
-            for entry in lst_dct:
-                json.dump(entry, jsonl_file)
-                jsonl_file.write("\n")
-    except TypeError as e:
-        print(f"failed for {str(path)} because of: {e}, which might be an already processed file")
-
-
 if path.is_dir():
-    for single_path in path.glob("*.jl"):
-        process_file(single_path)
+    data_utils.ingest_dir(path, max_workers=args.workers)
 
 
 else:
-    process_file(path)
+    data_utils.ingest_files([path], manifest_path=path.parent / ".ingest.json", max_workers=args.workers)
@@ -0,0 +1,41 @@
+#! /usr/bin/env python3
+"""Throughput and parity with the fp32 pytorch reference of every sentiment backend.
+
+Run from the repository root with the models cached locally:
+    PYTHONPATH=src python3 benchmarks/bench_backends.py --path data/guardian-match-reports --threads 4
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+from models import sentiment_backends
+from utils import data_utils, utils
+
+parser = argparse.ArgumentParser(description="Benchmark sentiment backends")
+parser.add_argument("--path", type=Path, default=Path("data/guardian-match-reports"), help="jsonl file or folder of articles")
+parser.add_argument("--sentences", type=int, default=2000, help="number of sentences to use")
+parser.add_argument("--threads", type=int, default=None, help="intra op threads per backend")
+parser.add_argument("--batch-size", type=int, default=32)
+parser.add_argument("--backends", nargs="+", default=list(sentiment_backends.BACKENDS))
+args = parser.parse_args()
+
+# paragraphs stand in for sentences, which keeps spacy out of this benchmark
+texts = []
+for article in data_utils.read_jsonl(args.path, fields=["text"]):
+    texts.extend(paragraph for paragraph in article.get("text", "").split("\n\n") if paragraph.strip())
+    if len(texts) >= args.sentences:
+        break
+texts = texts[: args.sentences]
+
+reference = sentiment_backends.load_backend("pytorch", num_threads=args.threads)
+report = {}
+for name in args.backends:
+    backend = reference if name == "pytorch" else sentiment_backends.load_backend(name, num_threads=args.threads)
+    ts = time.time()
+    for batch in utils.chunks(texts, args.batch_size):
+        backend(batch)
+    secs = time.time() - ts
+    report[name] = {"sents_per_sec": len(texts) / secs, **sentiment_backends.parity_check(backend, reference, texts)}
+
+print(json.dumps(report, indent=2))
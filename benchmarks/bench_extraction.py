@@ -0,0 +1,59 @@
+#! /usr/bin/env python3
+"""Compares the single pass extract_features with the reference entity/pos/sentence extraction.
+
+Run from the repository root with the models cached locally:
+    PYTHONPATH=src python3 benchmarks/bench_extraction.py --path data/guardian-match-reports --limit 200
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from models.soccer_text_model import SoccerTagger
+
+parser = argparse.ArgumentParser(description="Benchmark per article feature extraction")
+parser.add_argument("--path", type=Path, default=Path("data/guardian-match-reports"), help="jsonl file or folder of articles")
+parser.add_argument("--limit", type=int, default=200, help="number of articles to use")
+parser.add_argument("--repeat", type=int, default=5, help="timed passes over the articles")
+args = parser.parse_args()
+path = args.path.resolve()
+
+# the tagger keeps its bookkeeping in ./data, so keep it out of the working tree
+os.chdir(tempfile.mkdtemp())
+Path("data").mkdir()
+
+tagger = SoccerTagger(s3_client=None, sync=False)
+articles = [article for article in tagger.get_data(path=path) if "text" in article][: args.limit]
+docs = list(tagger.spacy.pipe(article["text"] for article in articles))
+
+
+def reference(doc):
+    sent_range = [{"start_char": sent.start_char, "end_char": sent.end_char} for sent in doc.sents]
+    return tagger.entity_labels(doc), tagger.pos_tag_entities(doc), sent_range
+
+
+identical = all(reference(doc) == tagger.extract_features(doc) for doc in docs)
+
+timings = {}
+for name, extract in (("reference", reference), ("extract_features", tagger.extract_features)):
+    ts = time.perf_counter()
+    for _ in range(args.repeat):
+        for doc in docs:
+            extract(doc)
+    timings[name] = (time.perf_counter() - ts) / (args.repeat * len(docs))
+
+print(
+    json.dumps(
+        {
+            "articles": len(docs),
+            "tokens_per_article": sum(len(doc) for doc in docs) / len(docs),
+            "identical": identical,
+            "reference_us_per_article": timings["reference"] * 1e6,
+            "extract_features_us_per_article": timings["extract_features"] * 1e6,
+            "speedup": timings["reference"] / timings["extract_features"],
+        },
+        indent=2,
+    )
+)
@@ -0,0 +1,60 @@
+#! /usr/bin/env python3
+"""Compares per sentence and batched sentiment inference.
+
+Run from the repository root with the models cached locally:
+    PYTHONPATH=src python3 benchmarks/bench_sentiment.py --path data/guardian-match-reports --limit 50
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from models.soccer_text_model import SoccerTagger
+from settings import settings
+
+parser = argparse.ArgumentParser(description="Benchmark sentence sentiment inference")
+parser.add_argument("--path", type=Path, default=Path("data/guardian-match-reports"), help="jsonl file or folder of articles")
+parser.add_argument("--limit", type=int, default=50, help="number of articles to use")
+parser.add_argument("--batch-size", type=int, default=settings.SENTIMENT_BATCH_SIZE)
+parser.add_argument("--max-tokens", type=int, default=settings.SENTIMENT_MAX_TOKENS)
+args = parser.parse_args()
+path = args.path.resolve()
+
+# the tagger keeps its bookkeeping in ./data, so keep it out of the working tree
+os.chdir(tempfile.mkdtemp())
+Path("data").mkdir()
+
+tagger = SoccerTagger(s3_client=None, sync=False)
+articles = [article for article in tagger.get_data(path=path) if "text" in article][: args.limit]
+docs = [tagger.spacy(article["text"]) for article in articles]
+texts = [sent.text for doc in docs for sent in doc.sents]
+
+ts = time.time()
+reference = [tagger.sentiment_pipe(text)[0] for text in texts]
+single_secs = time.time() - ts
+
+ts = time.time()
+batched = tagger.sentiment_texts(texts, batch_size=args.batch_size, max_tokens=args.max_tokens)
+batched_secs = time.time() - ts
+
+agreement = sum(ref["label"] == out["label"] for ref, out in zip(reference, batched)) / len(texts)
+max_drift = max(abs(ref["score"] - out["score"]) for ref, out in zip(reference, batched))
+
+print(
+    json.dumps(
+        {
+            "articles": len(articles),
+            "sentences": len(texts),
+            "batch_size": args.batch_size,
+            "max_tokens": args.max_tokens,
+            "single_sents_per_sec": len(texts) / single_secs,
+            "batched_sents_per_sec": len(texts) / batched_secs,
+            "speedup": single_secs / batched_secs,
+            "label_agreement": agreement,
+            "max_score_drift": max_drift,
+        },
+        indent=2,
+    )
+)
@@ -0,0 +1,183 @@
+#! /usr/bin/env python3
+"""Offline throughput benchmark of every stage of the tagging pipeline, on synthetic match reports.
+
+Reports are generated with Faker from a fixed seed, so runs on different commits see the same input.
+Models must be cached locally, nothing is downloaded. Prints (or writes) one json report with
+articles/sec, sentences/sec, p50/p95 latency per stage call and peak RSS:
+    PYTHONPATH=src python3 benchmarks/run_benchmarks.py --articles 200 --output bench_output.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+# never reach for the network, and keep caches from hiding the cost of a stage
+os.environ.update({"HF_HUB_OFFLINE": "1", "TRANSFORMERS_OFFLINE": "1", "SENTIMENT_CACHE": "false", "DOC_CACHE": "false"})
+
+import numpy as np  # noqa: E402
+from faker import Faker  # noqa: E402
+
+from models.soccer_text_model import SoccerTagger  # noqa: E402
+from settings import settings  # noqa: E402
+from utils import data_utils, utils  # noqa: E402
+
+TEAMS = {
+    "Arsenal": "Emirates Stadium",
+    "Chelsea": "Stamford Bridge",
+    "Everton": "Goodison Park",
+    "Liverpool": "Anfield",
+    "Manchester City": "Etihad Stadium",
+    "Manchester United": "Old Trafford",
+    "Norwich City": "Carrow Road",
+    "Tottenham Hotspur": "Tottenham Hotspur Stadium",
+    "West Ham United": "London Stadium",
+    "Wolverhampton Wanderers": "Molineux",
+}
+TEMPLATES = [
+    "{player} opened the scoring in the {minute}th minute with a {adj} finish past {keeper}.",
+    "{team} were {adj} throughout and {player} was {adv} denied by the post.",
+    "“It was a {adj} performance,” said {manager}, who was {adv} pleased with {player}.",
+    "{keeper} made a {adj} save to keep {team} in the game before half-time.",
+    "After the break {player} combined with {other} and {team} doubled their lead.",
+    "The {adj} defending from {team} allowed {player} to run {adv} into the box.",
+]
+ADJECTIVES = ["superb", "poor", "brilliant", "sloppy", "composed", "nervous", "clinical", "dreadful"]
+ADVERBS = ["barely", "rightly", "quickly", "narrowly", "clearly", "hardly"]
+
+
+def synthetic_reports(n_articles: int, paragraphs: int, seed: int):
+    fake = Faker("en_GB")
+    fake.seed_instance(seed)
+    rnd = random.Random(seed)
+    for i in range(n_articles):
+        home, away = rnd.sample(list(TEAMS), 2)
+        players = [f"{fake.first_name_male()} {fake.last_name()}" for _ in range(8)]
+        text = []
+        for _ in range(paragraphs):
+            sentences = [
+                rnd.choice(TEMPLATES).format(
+                    player=rnd.choice(players),
+                    other=rnd.choice(players),
+                    keeper=rnd.choice(players),
+                    manager=f"{fake.first_name_male()} {fake.last_name()}",
+                    team=rnd.choice([home, away]),
+                    minute=rnd.randint(1, 90),
+                    adj=rnd.choice(ADJECTIVES),
+                    adv=rnd.choice(ADVERBS),
+                )
+                for _ in range(rnd.randint(2, 4))
+            ]
+            text.append(" ".join(sentences))
+        yield {
+            "scrape_date": "2021-05-25",
+            "link": f"https://www.theguardian.com/football/synthetic/{i}",
+            "headline": f"{rnd.choice(players)} inspires {home} against {away}",
+            "home_team": home,
+            "away_team": away,
+            "match_date": str(date(2019, 8, 1) + timedelta(days=rnd.randint(0, 300))),
+            "author": f"{fake.first_name()} {fake.last_name()}",
+            "stadium": TEAMS[home],
+            # raw reports come as a list of paragraphs, which ingest joins
+            "text": text,
+        }
+
+
+class StageTimer:
+    def __init__(self):
+        self.calls = {}
+
+    def time(self, stage: str, fn, *args, **kwargs):
+        ts = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.calls.setdefault(stage, []).append(time.perf_counter() - ts)
+        return result
+
+    def report(self, n_articles: int, n_sentences: int) -> dict:
+        report = {}
+        for stage, secs in self.calls.items():
+            total = sum(secs)
+            report[stage] = {
+                "calls": len(secs),
+                "total_secs": round(total, 4),
+                "articles_per_sec": round(n_articles / total, 2) if total else None,
+                "sentences_per_sec": round(n_sentences / total, 2) if total else None,
+                "p50_ms": round(float(np.percentile(secs, 50)) * 1000, 3),
+                "p95_ms": round(float(np.percentile(secs, 95)) * 1000, 3),
+            }
+        return report
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+parser = argparse.ArgumentParser(description="Benchmark the tagging pipeline on synthetic match reports")
+parser.add_argument("--articles", type=int, default=200, help="number of synthetic reports")
+parser.add_argument("--paragraphs", type=int, default=12, help="paragraphs per report")
+parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--batch-size", type=int, default=settings.SPACY_BATCH_SIZE)
+parser.add_argument("--output", type=Path, default=None, help="write the json report here instead of stdout")
+args = parser.parse_args()
+output = args.output.resolve() if args.output else None
+
+workdir = Path(tempfile.mkdtemp())
+os.chdir(workdir)
+data_path = Path("data/guardian-match-reports")
+data_path.mkdir(parents=True)
+
+timer = StageTimer()
+ts = time.perf_counter()
+with open(data_path / "synthetic.jl", "w") as jsonl_file:
+    for report in synthetic_reports(args.articles, args.paragraphs, args.seed):
+        jsonl_file.write(json.dumps(report) + "\n")
+generate_secs = time.perf_counter() - ts
+
+load_times = {}
+with utils.timer(load_times, "load_models"):
+    tagger = SoccerTagger(s3_client=None, sync=False)
+
+timer.time("ingest", data_utils.ingest_dir, data_path, max_workers=1)
+articles = timer.time("load_jsonl", list, tagger.iter_data(path=data_path))
+n_sentences = 0
+for window in utils.chunks(articles, args.batch_size):
+    docs = timer.time("spacy_parse", list, tagger.spacy.pipe([article["text"] for article in window], batch_size=args.batch_size))
+    n_sentences += sum(len(list(doc.sents)) for doc in docs)
+    sentiments = timer.time("sentiment", tagger.sentiment_docs, docs)
+    for doc, article, doc_sentiments in zip(docs, window, sentiments):
+        timer.time("extract", tagger.tag_doc, doc, article, sentiments=doc_sentiments)
+        # save, indexes, columnar output and the kvstore, exactly as forward finishes an article
+        timer.time("finish", tagger.finish, article)
+    for article_index in tagger.indexes.values():
+        timer.time("index_commit", article_index.commit)
+if tagger.columnar is not None:
+    timer.time("columnar_close", tagger.columnar.close)
+timer.time("kvstore_snapshot", tagger.kvstore.key_set)
+
+stages = timer.report(len(articles), n_sentences)
+pipeline_secs = sum(stage["total_secs"] for stage in stages.values())
+result = {
+    "commit": git_commit(),
+    "config": {**vars(args), "output": str(output) if output else None, "sentiment_backend": settings.SENTIMENT_BACKEND},
+    "articles": len(articles),
+    "sentences": n_sentences,
+    "generate_secs": round(generate_secs, 4),
+    "load_ms": load_times,
+    "articles_per_sec": round(len(articles) / pipeline_secs, 2),
+    "sentences_per_sec": round(n_sentences / pipeline_secs, 2),
+    # ru_maxrss is in KiB on linux
+    "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    "stages": stages,
+}
+if output:
+    output.write_text(json.dumps(result, indent=2))
+else:
+    print(json.dumps(result, indent=2))
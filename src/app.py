@@ -1,21 +1,37 @@
+import asyncio
 import json
+import queue
 import sys
+from datetime import date
 from pathlib import Path
 
-from cachetools import LRUCache, cached
-from fastapi import FastAPI, HTTPException, Response
+import jmespath
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel, Field
-from typing import Union, List
+from typing import Callable, Dict, Optional, Union, List
 
 from models.soccer_text_model import SoccerTagger, SoccerArticles
 from settings import settings
+from utils import batch_utils, cache_utils, index_utils, job_utils, metrics_utils, registry_utils, transfer_utils, utils
+
+logger = utils.get_logger(f"{__name__}.log")
 
 app = FastAPI()
-cache = LRUCache(maxsize=4)
+# jobs run one at a time, so /update queues behind the warm up instead of loading the models twice
+jobs = job_utils.JobRunner(max_workers=1)
+# loaded once and kept until /reload, responses are cached apart from them and keyed by their version
+models = registry_utils.ModelRegistry(
+    {
+        "articles": lambda reload: SoccerArticles(transfer_utils.get_s3_client(), force_sync=reload),
+        "tagger": lambda reload: SoccerTagger(transfer_utils.get_s3_client(), force_sync=reload),
+    }
+)
+responses = cache_utils.ResponseCache(max_bytes=settings.RESPONSE_CACHE_MAX_BYTES, ttl=settings.RESPONSE_CACHE_TTL)
 
 
 class TextInput(BaseModel):
-    text: str = Field(None, title="The text to anynomize")
+    text: str = Field(..., title="The match report to tag")
 
 
 class TextOutput(BaseModel):
@@ -37,47 +53,266 @@ class ActionOutput(BaseModel):
     out: Union[List[str], str] = Field(None, title="The redacted text or extracted entities")
 
 
+class TagOutput(BaseModel):
+    entity_labels: Dict[str, List[str]] = Field({}, title="Named entities by label")
+    sentence_info: List[list] = Field([], title="Per sentence pos tags and entities, sentiment and char span")
+
+
+class MentionsOutput(BaseModel):
+    results: List[dict] = Field([], title="Mentions with article id, sentence index, char span and sentence sentiment")
+    next_cursor: Optional[int] = Field(None, title="Cursor of the next page, None on the last page")
+
+
+class RosterPlayer(BaseModel):
+    player: str
+    appearances: int = Field(0, title="Reports of the team's matches naming the player")
+    co_mentions: int = Field(0, title="Sentences naming both the player and the team")
+
+
+class PlayersOutput(BaseModel):
+    teams: Dict[str, List[RosterPlayer]] = Field({}, title="Players per requested team, most mentioned first")
+
+
+class MatchOutput(BaseModel):
+    article_id: str
+    home_team: Optional[str]
+    away_team: Optional[str]
+    match_date: Optional[str]
+    headline: Optional[str]
+    link: Optional[str]
+    stadium: Optional[str]
+    players: List[str] = Field([], title="Players named in the report")
+
+
+class QueryOutput(BaseModel):
+    results: List[dict] = Field([], title="Article id and the non empty result of the expression on the article")
+    next_cursor: Optional[int] = Field(None, title="Cursor of the next page, None on the last page")
+
+
+class SentimentBucket(BaseModel):
+    bucket: str = Field(None, title="Day, week (yyyy-Www), month (yyyy-mm) or year")
+    mean_score: float = Field(None, title="Mean sentence score, negative for NEGATIVE sentences")
+    count: int = Field(0, title="Sentences")
+    positive: int = 0
+    negative: int = 0
+
+
+class SentimentSeriesOutput(BaseModel):
+    name: str
+    kind: str
+    granularity: str
+    buckets: List[SentimentBucket] = []
+
+
+class JobOutput(BaseModel):
+    id: str = Field(None, title="Job id, poll /jobs/{id} for progress")
+    name: str
+    status: str = Field(None, title="'queued', 'running', 'done' or 'failed'")
+    done: int = Field(0, title="Articles done")
+    total: Optional[int] = Field(None, title="Articles to do, once known")
+    secs: float
+    per_sec: float = Field(0.0, title="Articles per second")
+    eta_secs: Optional[float]
+    error: Optional[str]
+
+
+class ComponentHealth(BaseModel):
+    ready: bool = False
+    load_secs: Optional[float] = Field(None, title="Total load time")
+    load_times: Dict[str, int] = Field({}, title="ms per loading step")
+    error: Optional[str]
+
+
 class HealthResponse(BaseModel):
     ready: bool
+    components: Dict[str, ComponentHealth] = {}
 
 
-@app.get("/update")
-async def update():
+@app.get("/update", response_model=JobOutput)
+async def update(response: Response, profile: bool = False):
 
-    # Fetch model
+    # Tag in the background, a run already in progress is returned instead of starting another
+    job, created = jobs.submit("update", run_profiled_update if profile else run_update)
+    response.status_code = 202 if created else 200
+    return JobOutput(**job.report())
+
+
+@app.post("/tag", response_model=TagOutput)
+async def tag(text_input: TextInput):
+    require_ready("tagger")
+
+    # Coalesced with concurrent requests into one batch through the models
+    try:
+        future = tag_batcher.submit({"text": text_input.text})
+    except queue.Full:
+        raise HTTPException(status_code=503, detail="too many reports waiting to be tagged, retry later")
+    out = await asyncio.wrap_future(future)
+
+    # Return prediction result
+    res = TagOutput(entity_labels=out["entity_labels"], sentence_info=out["sentence_info"])
+    return res
+
+
+@app.get("/jobs/{job_id}", response_model=JobOutput)
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"no job with id {job_id}")
+    return JobOutput(**job.report())
+
+
+@app.get("/jobs/{job_id}/profile", response_class=PlainTextResponse)
+async def get_job_profile(job_id: str, sort: str = "cumulative", limit: int = Query(50, ge=1, le=1000)):
+    path = profile_path(job_id)
+    if not path.exists():
+        raise HTTPException(status_code=404, detail=f"no profile for job {job_id}, start one with /update?profile=true")
+    return metrics_utils.profile_report(path, sort=sort, limit=limit)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # prometheus text exposition format
+    return PlainTextResponse(metrics_utils.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+def profile_path(job_id: str) -> Path:
+    return Path(settings.PROFILE_DIR) / f"{job_id}.prof"
+
+
+def tag_batch(articles: List[dict]) -> List[dict]:
+    return get_tagger().forward_passes(articles)
+
+
+# one thread feeds the models, started on import so the first request doesn't pay for it
+tag_batcher = batch_utils.MicroBatcher(
+    "tag",
+    tag_batch,
+    max_batch_size=settings.TAG_MAX_BATCH_SIZE,
+    max_wait_ms=settings.TAG_MAX_WAIT_MS,
+    max_queue=settings.TAG_MAX_QUEUE,
+)
+
+
+def run_update(job: job_utils.Job):
+    # Fetch model, in the worker thread so loading doesn't block either
     soccer_tagger = get_tagger()
 
-    soccer_tagger.forward()
+    soccer_tagger.forward(progress=job)
+
+
+def run_profiled_update(job: job_utils.Job):
+    # cProfile only sees the thread it is enabled in, which is the one running the whole update
+    metrics_utils.profiled(run_update, profile_path(job.id))(job)
+
+
+# sqlite lookups and article store scans block, plain def endpoints run on fastapi's threadpool instead of the event loop
+@app.post("/players", response_model=PlayersOutput)
+def players(request: Request, teams: List[str], limit: int = Query(50, ge=1, le=1000)):
+    require_ready("articles")
+
+    # Fetch model
+    soccer_articles = get_soccer_articles()
+
+    # Get from the match catalogue, the requested names are the keys of the response so they key it as given
+    key = ("players", tuple(teams), limit)
+    return cached_response(request, key, lambda: PlayersOutput(teams=soccer_articles.players(teams, limit=limit)))
+
+
+@app.get("/matches", response_model=List[MatchOutput])
+def matches(
+    team: Optional[str] = None,
+    home_team: Optional[str] = None,
+    away_team: Optional[str] = None,
+    match_date: Optional[date] = None,
+    limit: int = Query(50, ge=1, le=1000),
+):
+    require_ready("articles")
+
+    # Fetch model
+    soccer_articles = get_soccer_articles()
+
+    # Get from the match catalogue
+    out = soccer_articles.games(
+        team=team,
+        home_team=home_team,
+        away_team=away_team,
+        match_date=match_date.isoformat() if match_date else None,
+        limit=limit,
+    )
 
     # Return prediction result
-    return 200
+    res = [MatchOutput(**match) for match in out]
+    return res
 
 
-@app.post("/players")
-async def players(teams: List):
+@app.get("/player_mentions", response_model=MentionsOutput)
+def player_mentions(request: Request, player: str, cursor: int = 0, limit: int = Query(50, ge=1, le=1000)):
+    require_ready("articles")
 
     # Fetch model
     soccer_articles = get_soccer_articles()
 
-    # Get from data
-    out = soccer_articles.players(player)
+    # Get from index, spellings the index treats as one player share a cache entry
+    key = ("player_mentions", index_utils.normalise_entity(player), cursor, limit)
+    return cached_response(request, key, lambda: MentionsOutput(**soccer_articles.player_mentions(player, cursor=cursor, limit=limit)))
+
+
+@app.get("/query", response_model=QueryOutput)
+def query(
+    expression: str,
+    team: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    cursor: int = 0,
+    limit: int = Query(50, ge=1, le=1000),
+):
+    require_ready("articles")
+
+    # Fetch model
+    soccer_articles = get_soccer_articles()
+
+    # Evaluate one article at a time, pre filtered by the match catalogue when team or dates are given
+    try:
+        out = soccer_articles.query(
+            expression,
+            team=team,
+            start=start.isoformat() if start else None,
+            end=end.isoformat() if end else None,
+            cursor=cursor,
+            limit=limit,
+        )
+    except jmespath.exceptions.JMESPathError as e:
+        raise HTTPException(status_code=400, detail=f"invalid expression: {e}")
 
     # Return prediction result
-    res = TextOutput(text=out)
+    res = QueryOutput(**out)
     return res
 
 
-@app.get("/player_mentions")
-async def player_mentions(player: str):
+@app.get("/sentiment", response_model=SentimentSeriesOutput)
+def sentiment(
+    name: str,
+    kind: str = Query("entity", regex="^(entity|team)$"),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    granularity: str = Query("month", regex="^(day|week|month|year)$"),
+):
+    require_ready("articles")
 
     # Fetch model
     soccer_articles = get_soccer_articles()
 
-    # Get from data
-    out = soccer_articles.player_mentions(player)
+    # Get from the aggregates, match dates are yyyy-mm-dd like the iso dates
+    out = soccer_articles.sentiment_series(
+        name,
+        kind=kind,
+        start=start.isoformat() if start else None,
+        end=end.isoformat() if end else None,
+        granularity=granularity,
+    )
 
     # Return prediction result
-    res = TextOutput(text=out)
+    res = SentimentSeriesOutput(name=name, kind=kind, granularity=granularity, buckets=out)
     return res
 
 
@@ -90,34 +325,74 @@ async def get_health(response: Response):
 
 @app.get("/clear_cache")
 async def clear_cache():
-    cache.clear()
+    # only the cached responses, the models stay loaded, see /reload
+    responses.clear()
     return True
 
 
+@app.get("/reload", response_model=JobOutput)
+async def reload(response: Response, component: str = Query(..., regex="^(articles|tagger)$")):
+
+    # Load again in the background, the loaded one keeps serving until the new one replaces it
+    job, created = jobs.submit(f"reload_{component}", lambda job: models.reload(component))
+    response.status_code = 202 if created else 200
+    return JobOutput(**job.report())
+
+
+@app.on_event("startup")
+async def startup():
+    if settings.WARM_UP_ON_STARTUP:
+        jobs.submit("warm_up", warm_up)
+
+
 async def get_health_info() -> HealthResponse:
-    # do checks
-    ready = True
-    return HealthResponse(ready=ready)
+    # ready once every component is loaded, so the platform holds traffic until then
+    ready = all(models.ready(name) for name in models.loaders)
+    return HealthResponse(ready=ready, components=models.status)
+
+
+def require_ready(name: str):
+    if not models.ready(name):
+        jobs.submit("warm_up", warm_up)
+        raise HTTPException(status_code=503, detail=f"{name} is still loading")
+
+
+def warm_up(job: job_utils.Job):
+    job.set_total(len(models.loaders))
+    for name in models.loaders:
+        try:
+            models.get(name)
+        except Exception:
+            # the error is kept in the component's health, loading is tried again on the next request
+            pass
+        job.advance()
+
+
+def cached_response(request: Request, key: tuple, render: Callable[[], BaseModel]) -> Response:
+    """
+    The json of render(), cached under key and the version of the articles and indexes it was computed from,
+    which includes the commits of a tagger running /update.
+    A client sending back the ETag of an unchanged response in If-None-Match gets an empty 304.
+    """
+    soccer_articles = get_soccer_articles()
+    version = (models.versions["articles"], soccer_articles.data_version)
+    body, etag = responses.get_or_render((*key, version), lambda: render().json().encode("utf-8"))
+    if etag in (tag.strip() for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    # no-cache lets clients keep the body but makes them revalidate it, answered by the 304 above
+    return Response(content=body, media_type="application/json", headers={"ETag": etag, "Cache-Control": "no-cache"})
 
 
-@cached(cache=cache)
-def get_tagger():
-    tagger = SoccerTagger()
-    return tagger
+def get_tagger() -> SoccerTagger:
+    return models.get("tagger")
 
 
-@cached(cache=cache)
-def get_soccer_articles():
-    soccer_articles = SoccerArticles()
-    return soccer_articles
+def get_soccer_articles() -> SoccerArticles:
+    return models.get("articles")
 
 
 #  convert to using MongoDB next!!
 
-# GET players in team or teams, to further search
 # Search on team or player to get either all adjectives in a count
-# should be able to match on specific game
-# get game details (so ADJ, sent and players ...  by home team, away_team and date)
 # split all on game date
-# get average sentiment for team or player (and conditioned on time)
 # also consider VAR still
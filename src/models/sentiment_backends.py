@@ -0,0 +1,131 @@
+"""CPU inference backends for the sentence sentiment stage.
+
+Every backend is called like a transformers sentiment pipeline, with a list of texts giving a list of
+{"label", "score"}, and exposes its tokenizer, so SoccerTagger can swap them freely:
+- "pytorch": the plain fp32 transformers pipeline, the reference
+- "pytorch-int8": the same model with its linear layers dynamically quantized to int8
+- "onnx": the model exported to onnx and run by an onnxruntime session
+"""
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from settings import settings
+from utils import utils
+
+logger = utils.get_logger(f"{__name__}.log")
+
+
+class PytorchBackend:
+    def __init__(self, model: str, revision: str = "main", num_threads: int = None):
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.tokenizer = AutoTokenizer.from_pretrained(model, revision=revision)
+        self.model = self.prepare(AutoModelForSequenceClassification.from_pretrained(model, revision=revision))
+        self.pipe = pipeline("sentiment-analysis", model=self.model, tokenizer=self.tokenizer)
+
+    def prepare(self, model):
+        return model
+
+    def __call__(self, texts: List[str]) -> List[dict]:
+        return self.pipe(texts)
+
+
+class QuantizedBackend(PytorchBackend):
+    def prepare(self, model):
+        import torch
+
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxBackend:
+    """
+    Exports the model to onnx on first use, to onnx_dir, and runs it with onnxruntime.
+
+    params:
+    - onnx_dir: folder of exported models, one file per model and revision
+    """
+
+    def __init__(self, model: str, revision: str = "main", num_threads: int = None, onnx_dir: Path = Path("data/onnx")):
+        import onnxruntime
+        from transformers import AutoConfig, AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model, revision=revision)
+        self.id2label = AutoConfig.from_pretrained(model, revision=revision).id2label
+        onnx_path = onnx_dir / f"{model.replace('/', '--')}@{revision}.onnx"
+        if not onnx_path.exists():
+            self.export(model, revision, onnx_path)
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(str(onnx_path), options, providers=["CPUExecutionProvider"])
+
+    def export(self, model: str, revision: str, onnx_path: Path):
+        import torch
+        from transformers import AutoModelForSequenceClassification
+
+        torch_model = AutoModelForSequenceClassification.from_pretrained(model, revision=revision)
+        torch_model.eval()
+        # return_dict=False makes the model return a plain tuple, which the exporter can trace
+        torch_model.config.return_dict = False
+        dummy = self.tokenizer(["an example sentence"], return_tensors="pt")
+        onnx_path.parent.mkdir(parents=True, exist_ok=True)
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in ("input_ids", "attention_mask", "logits")}
+        torch.onnx.export(
+            torch_model,
+            (dummy["input_ids"], dummy["attention_mask"]),
+            str(onnx_path),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=12,
+        )
+        logger.info(f"exported {model}@{revision} to {str(onnx_path)}")
+
+    def __call__(self, texts: List[str]) -> List[dict]:
+        encoded = self.tokenizer(texts, padding=True, return_tensors="np")
+        inputs = {"input_ids": encoded["input_ids"].astype(np.int64), "attention_mask": encoded["attention_mask"].astype(np.int64)}
+        logits = self.session.run(["logits"], inputs)[0]
+        # same softmax and argmax as the text classification pipeline
+        scores = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        scores = scores / scores.sum(axis=-1, keepdims=True)
+        return [{"label": self.id2label[int(row.argmax())], "score": float(row.max())} for row in scores]
+
+
+BACKENDS: Dict[str, Callable] = {
+    "pytorch": PytorchBackend,
+    "pytorch-int8": QuantizedBackend,
+    "onnx": OnnxBackend,
+}
+
+
+def load_backend(
+    name: str = settings.SENTIMENT_BACKEND,
+    model: str = settings.SENTIMENT_MODEL,
+    revision: str = settings.SENTIMENT_MODEL_REVISION,
+    num_threads: int = settings.SENTIMENT_NUM_THREADS,
+):
+    if name not in BACKENDS:
+        raise ValueError(f"unknown sentiment backend {name}, choose from {list(BACKENDS)}")
+    backend = BACKENDS[name](model, revision=revision, num_threads=num_threads)
+    logger.info(f"loaded {name} sentiment backend for {model}@{revision}")
+    return backend
+
+
+def parity_check(backend, reference, texts: List[str], batch_size: int = 32) -> dict:
+    """Label agreement and score drift of backend against reference, e.g. the pytorch backend."""
+    expected, actual = [], []
+    for batch in utils.chunks(texts, batch_size):
+        expected.extend(reference(batch))
+        actual.extend(backend(batch))
+    drift = np.array([abs(ref["score"] - out["score"]) for ref, out in zip(expected, actual)])
+    return {
+        "sentences": len(texts),
+        "label_agreement": float(np.mean([ref["label"] == out["label"] for ref, out in zip(expected, actual)])),
+        "max_score_drift": float(drift.max()) if len(drift) else 0.0,
+        "mean_score_drift": float(drift.mean()) if len(drift) else 0.0,
+    }
@@ -1,77 +1,235 @@
-import boto3
-from pathlib import Path
+from collections import deque
 from datetime import datetime
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+import multiprocessing
+from pathlib import Path
 import json
-import spacy
+import os
+import shutil
+import threading
 from typing import List, Dict
-from transformers import pipeline
+import zlib
+
+from cachetools import LRUCache, cached
 import jmespath
 
-from utils import data_utils, utils
+from utils import cache_utils, data_utils, index_utils, job_utils, metrics_utils, store_utils, transfer_utils, utils
 from settings import settings
 
 logger = utils.get_logger(f"{__name__}.log")
 
+ARTICLES = metrics_utils.registry.counter("articles_total", "Articles finished by forward", ["outcome"])
+
+# components of the en_core_web v3 pipelines, and the ones each tagging stage needs
+SPACY_COMPONENTS = ["tok2vec", "tagger", "parser", "senter", "attribute_ruler", "lemmatizer", "ner"]
+SPACY_STAGE_COMPONENTS = {
+    "ner": ["ner"],
+    # coarse pos tags are mapped from the fine grained tags by the attribute ruler
+    "pos": ["tok2vec", "tagger", "attribute_ruler"],
+    "sents": ["tok2vec", "parser"],
+}
+
+
+@cached(cache=LRUCache(maxsize=settings.QUERY_CACHE_SIZE), lock=threading.Lock())
+def compile_query(expression: str):
+    # raises jmespath.exceptions.ParseError for invalid expressions, which are not cached
+    return jmespath.compile(expression)
+
 
 class SoccerText:
-    def __init__(self, s3_client: boto3.client):
+    def __init__(self, s3_client):
         self.s3_client = s3_client
+        # ms spent on each loading step, reported by /health
+        self.load_times: Dict[str, int] = {}
 
-    def sync_data(self, s3_folder: Path = Path("guardian-match-reports")):
-        folder_path = Path("data") / s3_folder
-        if folder_path.exists() and folder_path.stat().st_size > 4 * 32:
-            folder_update_time = datetime.fromtimestamp(folder_path.stat().st_atime)
-
-        else:
-            data_utils.download_dir(
-                prefix=str(s3_folder),
-                local=folder_path,
-                bucket=settings.DATA_S3_BUCKET,
-                s3_client=self.s3_client,
-            )
-            for single_path in folder_path.glob(f"*.jl"):
-                data_utils.process_file(single_path)
-                logger.info(f"processed {str(single_path)}")
-            folder_update_time = datetime.fromtimestamp(folder_path.stat().st_mtime)
-
-        if datetime.now() - folder_update_time > settings.FOLDER_UPDATE_FREQ:
-            data_utils.download_dir(
-                prefix=str(s3_folder),
-                local=folder_path,
-                bucket=settings.DATA_S3_BUCKET,
-                s3_client=s3_client,
-            )
-            for single_path in folder_path.glob(f"*.jl"):
-                data_utils.process_file(single_path)
-                logger.info(f"processed {str(single_path)}")
+    @utils.timeit
+    def sync_data(
+        self, s3_folder: Path = Path("guardian-match-reports"), local: Path = None, ingest: bool = True, force: bool = False
+    ):
+        folder_path = local or Path("data") / s3_folder
+        changed, removed = data_utils.sync_dir(
+            prefix=str(s3_folder),
+            local=folder_path,
+            bucket=settings.DATA_S3_BUCKET,
+            s3_client=self.s3_client,
+            # a forced sync lists s3 even if the folder was synced recently
+            min_interval=None if force else settings.FOLDER_UPDATE_FREQ,
+        )
+        # only files that changed since they were last normalised are rewritten
+        if ingest and folder_path.is_dir():
+            data_utils.ingest_dir(folder_path)
+        return changed, removed
 
     def upload_data(self, path: Path):
-        response = self.s3_client.upload_file(str(path), settings.DATA_S3_BUCKET, str(path))
+        response = transfer_utils.upload_file(path, bucket=settings.DATA_S3_BUCKET, key=str(path), s3_client=self.s3_client)
         return response
 
-    def get_data(self, path: Path = Path("data/guardian-match-reports")):
-        if path.is_file():
-            lst_dct = [json.loads(line) for line in open(path, "r").read().split("\n") if line]
-        else:
-            lst_dct = []
-            for file_path in path.glob("*.jl"):
-                lst_dct.extend([json.loads(line) for line in open(file_path, "r").read().split("\n") if line])
+    def upload_shards(self, folder: Path = Path(settings.TAGGED_DIR)) -> List[str]:
+        # shards never change, so only the ones missing from s3 are uploaded, and the manifest after them
+        remote = data_utils.list_objects(str(folder), bucket=settings.DATA_S3_BUCKET, s3_client=self.s3_client)
+        manifest = data_utils.load_shard_manifest(folder)
+        uploaded = [shard["name"] for shard in manifest["shards"] if str(folder / shard["name"]) not in remote]
+        for name in uploaded:
+            self.upload_data(path=folder / name)
+        if manifest["shards"]:
+            self.upload_data(path=folder / data_utils.SHARD_MANIFEST)
+        logger.info(f"uploaded {len(uploaded)} new shards")
+        return uploaded
+
+    def get_data(self, path: Path = Path("data/guardian-match-reports"), fields: List[str] = None):
+        lst_dct = list(self.iter_data(path=path, fields=fields))
         return lst_dct
 
+    def iter_data(self, path: Path = Path("data/guardian-match-reports"), fields: List[str] = None):
+        if not path.exists():
+            return iter([])
+        return data_utils.read_jsonl(path, fields=fields)
+
+
+def shard_of(article_id: str, n_shards: int) -> int:
+    # crc32 is stable across processes and runs, unlike hash()
+    return zlib.crc32(article_id.encode("utf-8")) % n_shards
+
+
+def forward_shard(shard: int, n_shards: int, shard_dir: Path, batch_size: int, n_process: int, num_threads: int) -> int:
+    """Worker of SoccerTagger.forward_sharded, tags the pending articles of one shard into its own file."""
+    tagger = SoccerTagger(
+        s3_client=None,
+        sync=False,
+        output_path=shard_dir / f"articles-{shard:03d}.jl",
+        index=False,
+        num_threads=num_threads,
+    )
+    articles = (article for article in tagger.pending_articles() if shard_of(article["id"], n_shards) == shard)
+    return tagger.tag_articles(articles, batch_size=batch_size, n_process=n_process)
+
 
 class SoccerTagger(SoccerText):
-    def __init__(self, s3_client: boto3.client):
+    """
+    params:
+    - s3_client: initialized s3 client object, None to work offline
+    - sync: sync the match reports from s3 before loading the models
+    - force_sync: sync even if the match reports were synced within FOLDER_UPDATE_FREQ
+    - output_path: jsonl file tagged articles are appended to
+    - index: keep the mention index and columnar output up to date, off in the workers of forward_sharded
+    - num_threads: torch / onnxruntime threads of the sentiment backend
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        sync: bool = True,
+        force_sync: bool = False,
+        output_path: Path = Path("data/articles.jl"),
+        index: bool = True,
+        num_threads: int = settings.SENTIMENT_NUM_THREADS,
+    ):
         super().__init__(s3_client)
-        self.sync_data(s3_folder=Path("guardian-match-reports"))
-        self.articles = self.get_data(path=Path("data/guardian-match-reports"))
-        self.spacy = self.load_spacy()
-        self.kvstore = data_utils.kvstore("data/processed.db")
-        self.sentiment_pipe = pipeline("sentiment-analysis")
-
-    def load_spacy(self):
-        nlp = spacy.load("en_core_web_sm")
+        self.data_path = Path("data/guardian-match-reports")
+        self.output_path = output_path
+        if sync:
+            with utils.timer(self.load_times, "sync_data"):
+                self.sync_data(s3_folder=Path("guardian-match-reports"), force=force_sync)
+        with utils.timer(self.load_times, "load_spacy"):
+            self.spacy = self.load_spacy()
+        # neither spacy nor the sentiment pipeline is thread safe, /tag batches and /update windows take turns
+        self.model_lock = threading.Lock()
+        self.doc_cache = None
+        if settings.DOC_CACHE:
+            self.doc_cache = cache_utils.DocCache(settings.DOC_CACHE_PATH, self.spacy)
+        with utils.timer(self.load_times, "load_stores"):
+            self.kvstore = data_utils.kvstore("data/processed.db")
+            # read side indexes of the tagged articles, kept up to date as articles are finished
+            self.indexes = {}
+            if index:
+                self.indexes = {
+                    "mentions": index_utils.MentionIndex("data/mentions.db"),
+                    "aggregates": index_utils.SentimentAggregates("data/aggregates.db"),
+                    "matches": index_utils.MatchCatalogue("data/matches.db"),
+                }
+        self.columnar = None
+        if settings.COLUMNAR_OUTPUT and index:
+            from utils import columnar_utils
+
+            self.columnar = columnar_utils.ColumnarSink(
+                Path("data/columnar"),
+                row_group_size=settings.COLUMNAR_ROW_GROUP_SIZE,
+                partition_by=settings.COLUMNAR_PARTITION_BY,
+            )
+        with utils.timer(self.load_times, "load_sentiment"):
+            self.sentiment_pipe = self.load_sentiment(num_threads=num_threads)
+        self.sentiment_cache = None
+        if settings.SENTIMENT_CACHE:
+            self.sentiment_cache = cache_utils.SentimentCache(
+                settings.SENTIMENT_CACHE_PATH,
+                # backends can drift slightly from each other, so they don't share results
+                model_id=f"{settings.SENTIMENT_MODEL}@{settings.SENTIMENT_MODEL_REVISION}/{settings.SENTIMENT_BACKEND}",
+                memory_size=settings.SENTIMENT_CACHE_MEMORY_SIZE,
+                max_rows=settings.SENTIMENT_CACHE_MAX_ROWS,
+            )
+
+    @property
+    def articles(self):
+        # read lazily on every access, so a run only holds the current batch in memory
+        return self.iter_data(path=self.data_path)
+
+    def load_spacy(self, stages: List[str] = settings.SPACY_STAGES):
+        # spacy and transformers are imported on load, importing this module stays cheap
+        import spacy
+
+        # components not needed by any of the stages are never loaded
+        needed = {component for stage in stages for component in SPACY_STAGE_COMPONENTS[stage]}
+        exclude = [component for component in SPACY_COMPONENTS if component not in needed]
+        nlp = spacy.load(settings.SPACY_MODEL, exclude=exclude)
+        logger.info(f"loaded {settings.SPACY_MODEL} with {nlp.pipe_names}")
         return nlp
 
+    def load_sentiment(self, backend: str = settings.SENTIMENT_BACKEND, num_threads: int = settings.SENTIMENT_NUM_THREADS):
+        from models import sentiment_backends
+
+        sentiment_pipe = sentiment_backends.load_backend(backend, num_threads=num_threads)
+        return sentiment_pipe
+
+    @utils.timeit
+    def extract_features(self, doc, pos_list: list = ["ADV", "ADJ"]):
+        """
+        entity_labels, per sentence pos tags / entities and sentence char ranges in a single pass over
+        token attribute arrays. Gives the same output as entity_labels, pos_tag_entities and the
+        sentence ranges, which are kept as the reference implementation.
+        """
+        ents = list(doc.ents)
+        entity_labels: Dict[str, List[str]] = {"PERSON": [ent.text for ent in ents if ent.label_ == "PERSON"]}
+        # index of the entity covering each token, -1 outside entities
+        token_ent = [-1] * len(doc)
+        for k, ent in enumerate(ents):
+            token_ent[ent.start : ent.end] = [k] * (ent.end - ent.start)
+        pos_ids = doc.to_array(["POS"]).tolist()
+        propn = doc.vocab.strings["PROPN"]
+        tag_names = {doc.vocab.strings[pos_tag]: pos_tag for pos_tag in pos_list}
+
+        sent_tags, sent_range = [], []
+        for sent in doc.sents:
+            # pos_tag_entities maps entity texts to the span of their last occurrence in the sentence, so
+            # tokens of earlier occurrences of the same text fall back to the token text, kept as is
+            last_of_text = {}
+            for k in sorted({k for k in token_ent[sent.start : sent.end] if k >= 0}):
+                if ents[k].start >= sent.start and ents[k].end <= sent.end:
+                    last_of_text[ents[k].text] = k
+            tags: Dict[str, List[str]] = {pos_tag: [] for pos_tag in pos_list}
+            sent_ents: Dict[str, None] = {}
+            for i in range(sent.start, sent.end):
+                pos_id = pos_ids[i]
+                if pos_id == propn:
+                    k = token_ent[i]
+                    related_ent = ents[k].text if k >= 0 and last_of_text.get(ents[k].text) == k else doc[i].text
+                    sent_ents.setdefault(related_ent)
+                if pos_id in tag_names:
+                    tags[tag_names[pos_id]].append(doc[i].text)
+            tags["ENT"] = list(sent_ents)
+            sent_tags.append(tags)
+            sent_range.append({"start_char": sent.start_char, "end_char": sent.end_char})
+        return entity_labels, sent_tags, sent_range
+
     def entity_labels(self, doc):
         entities: Dict[str, List[str]] = {"PERSON": []}
         for ent in doc.ents:
@@ -104,58 +262,402 @@ class SoccerTagger(SoccerText):
         return sent_tags
 
     def sentiment(self, doc):
-        sentiments = [self.sentiment_pipe(sent.text)[0] for sent in doc.sents]
-        sentiments = [{"sentiment": sentiment} for sentiment in sentiments]
+        sentiments = self.sentiment_docs([doc])[0]
         return sentiments
 
-    def forward(self):
+    @utils.timeit
+    def sentiment_docs(self, docs: list):
+        # sentences of all docs are batched together and split back per doc afterwards
+        sents_per_doc = [[sent.text for sent in doc.sents] for doc in docs]
+        results = self.sentiment_texts([text for texts in sents_per_doc for text in texts])
+        sentiments, start = [], 0
+        for texts in sents_per_doc:
+            sentiments.append([{"sentiment": result} for result in results[start : start + len(texts)]])
+            start += len(texts)
+        return sentiments
+
+    def sentiment_texts(
+        self,
+        texts: List[str],
+        batch_size: int = settings.SENTIMENT_BATCH_SIZE,
+        max_tokens: int = settings.SENTIMENT_MAX_TOKENS,
+    ):
+        if not texts:
+            return []
+        if self.sentiment_cache is not None:
+            results = self.sentiment_cache.get_many(texts)
+        else:
+            results = [None] * len(texts)
+
+        # each distinct uncached sentence runs through the model once
+        missing: Dict[str, List[int]] = {}
+        for i, (text, result) in enumerate(zip(texts, results)):
+            if result is None:
+                missing.setdefault(cache_utils.normalise_text(text), []).append(i)
+        if not missing:
+            return results
+        unique_texts = [texts[indices[0]] for indices in missing.values()]
+        unique_results: List[dict] = [None] * len(unique_texts)
+        lengths = [len(input_ids) for input_ids in self.sentiment_pipe.tokenizer(unique_texts)["input_ids"]]
+        metrics_utils.BATCH_SIZE.observe(len(unique_texts), stage="sentiment_unique")
+        for batch in utils.length_batches(lengths, batch_size=batch_size, max_tokens=max_tokens):
+            metrics_utils.BATCH_SIZE.observe(len(batch), stage="sentiment_model")
+            with metrics_utils.STAGE_SECONDS.time(stage="sentiment_model"):
+                outputs = self.sentiment_pipe([unique_texts[i] for i in batch])
+            for i, output in zip(batch, outputs):
+                unique_results[i] = output
+
+        for indices, result in zip(missing.values(), unique_results):
+            for i in indices:
+                results[i] = result
+        if self.sentiment_cache is not None:
+            self.sentiment_cache.put_many(unique_texts, unique_results)
+        return results
+
+    def forward(
+        self,
+        batch_size: int = settings.SPACY_BATCH_SIZE,
+        n_process: int = settings.SPACY_N_PROCESS,
+        progress: job_utils.Job = None,
+        n_workers: int = settings.FORWARD_WORKERS,
+    ):
+        if progress is not None:
+            progress.set_total(self.count_pending())
+        try:
+            if n_workers > 1:
+                self.forward_sharded(n_workers, batch_size=batch_size, n_process=n_process, progress=progress)
+            else:
+                self.tag_articles(self.pending_articles(), batch_size=batch_size, n_process=n_process, progress=progress)
+        finally:
+            # buffered articles are already marked as processed, so a failed run must still write them
+            if self.columnar is not None:
+                self.columnar.close()
+        if self.sentiment_cache is not None:
+            logger.info(f"sentiment cache: {self.sentiment_cache.stats()}")
+        self.publish()
+
+    def publish(self):
+        """Cuts the articles tagged since the last run into a new shard, and uploads the shards s3 doesn't have."""
+        data_utils.cut_shard(self.output_path, Path(settings.TAGGED_DIR), name=f"run-{datetime.now():%Y%m%dT%H%M%S}.jl")
+        self.upload_shards(Path(settings.TAGGED_DIR))
+
+    def tag_articles(
+        self,
+        articles,
+        batch_size: int = settings.SPACY_BATCH_SIZE,
+        n_process: int = settings.SPACY_N_PROCESS,
+        progress: job_utils.Job = None,
+    ) -> int:
+        """Tags and finishes articles, returns how many were tagged."""
+        tagged = 0
+        docs = self.iter_docs(articles, batch_size=batch_size, n_process=n_process, progress=progress)
+        windows = utils.chunks(docs, batch_size)
+        while True:
+            # the models are only held while parsing and scoring a window, finishing it lets /tag in
+            with self.model_lock:
+                window = next(windows, None)
+                if window is None:
+                    break
+                metrics_utils.BATCH_SIZE.observe(len(window), stage="forward_window")
+                sentiments = self.sentiment_docs([doc for doc, _ in window])
+                tagged_window = [
+                    self.tag_doc(doc, article, sentiments=doc_sentiments) for (doc, article), doc_sentiments in zip(window, sentiments)
+                ]
+            for article in tagged_window:
+                self.finish(article)
+            for article_index in self.indexes.values():
+                article_index.commit()
+            # the doc cache may be shared with other workers, so don't hold its write lock for the whole run
+            if self.doc_cache is not None:
+                self.doc_cache.commit()
+            tagged += len(window)
+            if progress is not None:
+                progress.advance(len(window))
+        return tagged
+
+    def forward_sharded(
+        self,
+        n_workers: int,
+        batch_size: int = settings.SPACY_BATCH_SIZE,
+        n_process: int = settings.SPACY_N_PROCESS,
+        progress: job_utils.Job = None,
+        shard_dir: Path = Path(settings.SHARD_DIR),
+    ):
+        """
+        Partitions the pending articles by id over n_workers processes, each loading its own models
+        once and appending to its own shard file. Completion is recorded in the WAL mode kvstore
+        shared by all of them, the shards are merged into output_path once every worker is done.
+        """
+        # shards left over by an interrupted run are already marked as processed, merge them first
+        self.merge_shards(shard_dir)
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        # split the cores between the workers, instead of every backend taking all of them
+        num_threads = settings.SENTIMENT_NUM_THREADS or max((os.cpu_count() or 1) // n_workers, 1)
+        processed_before = len(self.kvstore)
+        # forking a process that already holds torch threads can deadlock, so the workers start fresh
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as executor:
+            futures = [
+                executor.submit(forward_shard, shard, n_workers, shard_dir, batch_size, n_process, num_threads)
+                for shard in range(n_workers)
+            ]
+            running = futures
+            while running:
+                done, running = wait(futures, timeout=1.0, return_when=FIRST_EXCEPTION)
+                if progress is not None:
+                    progress.done = len(self.kvstore) - processed_before
+                for future in done:
+                    # raises the error of a failed worker, the finished shards are still merged next run
+                    future.result()
+        tagged = sum(future.result() for future in futures)
+        logger.info(f"tagged {tagged} articles in {n_workers} shards")
+        self.merge_shards(shard_dir)
+
+    def merge_shards(self, shard_dir: Path = Path(settings.SHARD_DIR)) -> int:
+        """Appends every shard to output_path, adds them to the mention index and columnar output, and removes them."""
+        merged = 0
+        for shard_path in sorted(shard_dir.glob("articles-*.jl")):
+            with open(shard_path, "rb") as shard_file, open(self.output_path, "ab") as output_file:
+                shutil.copyfileobj(shard_file, output_file)
+                output_file.flush()
+                os.fsync(output_file.fileno())
+            for article in data_utils.read_jsonl(shard_path):
+                if self.columnar is not None:
+                    self.columnar.add(article)
+                for article_index in self.indexes.values():
+                    article_index.add_article(article)
+                merged += 1
+            for article_index in self.indexes.values():
+                article_index.commit()
+            # the shard only goes once it is appended, a crash in between appends it twice rather than losing it
+            shard_path.unlink()
+        if merged:
+            logger.info(f"merged {merged} articles from shards in {str(shard_dir)}")
+        return merged
+
+    def pending_articles(self):
+        processed = self.kvstore.key_set()
+        ignored = 0
         for article in self.articles:
-            key = self.kvstore._get_key(article["id"])
-            if key in self.kvstore.keys():
-                logger.info(f"Ignoring already processed")
+            if self.kvstore._get_key(article["id"]) in processed:
+                ignored += 1
+            else:
+                yield article
+        logger.info(f"Ignored {ignored} already processed articles")
+
+    def count_pending(self):
+        processed = self.kvstore.key_set()
+        articles = self.iter_data(path=self.data_path, fields=["id"])
+        return sum(self.kvstore._get_key(article["id"]) not in processed for article in articles)
+
+    def article_texts(self, articles, progress: job_utils.Job = None):
+        # (text, article) tuples for nlp.pipe, articles without text are finished right away
+        for article in articles:
+            if "text" in article:
+                yield article["text"], article
             else:
-                article = self.forward_pass(article)
-                self.save(article, path=Path("data/articles.jl"))
-                key = self.kvstore._get_key(article["id"])
-                val = self.kvstore._get_val()
-                self.kvstore[key] = val
-                logger.info(f"Processed article with id {key}")
-        self.upload_data(path=Path("data/articles.jl"))
+                logger.info(f"Skipped article with id {article['id']} because of missing text")
+                self.finish(article, outcome="skipped")
+                if progress is not None:
+                    progress.advance()
+
+    def iter_docs(
+        self,
+        articles,
+        batch_size: int = settings.SPACY_BATCH_SIZE,
+        n_process: int = settings.SPACY_N_PROCESS,
+        progress: job_utils.Job = None,
+    ):
+        """(doc, article) of every article with text, taken from the doc cache or parsed with nlp.pipe."""
+        cached = deque()
+
+        def uncached(texts):
+            for text, article in texts:
+                doc = self.doc_cache.get(article["id"]) if self.doc_cache is not None else None
+                if doc is None:
+                    yield text, article
+                    continue
+                cached.append((doc, article))
+                # nlp.pipe only gives back control after parsing, an empty placeholder keeps cached docs from piling up
+                if len(cached) >= batch_size:
+                    yield "", None
+
+        texts = uncached(self.article_texts(articles, progress=progress))
+        parsed = self.spacy.pipe(texts, as_tuples=True, batch_size=batch_size, n_process=n_process)
+        while True:
+            # pipe parses a whole batch on the first next() of each batch, so the sum is what matters here
+            with metrics_utils.STAGE_SECONDS.time(stage="spacy_parse"):
+                doc, article = next(parsed, (None, None))
+            if doc is None:
+                break
+            while cached:
+                yield cached.popleft()
+            if article is None:
+                continue
+            if self.doc_cache is not None:
+                self.doc_cache.put(article["id"], doc)
+            yield doc, article
+        while cached:
+            yield cached.popleft()
+        if self.doc_cache is not None:
+            self.doc_cache.commit()
+
+    def finish(self, article: dict, outcome: str = "tagged"):
+        self.save(article, path=self.output_path)
+        if self.columnar is not None:
+            with metrics_utils.STAGE_SECONDS.time(stage="columnar"):
+                self.columnar.add(article)
+        for name, article_index in self.indexes.items():
+            with metrics_utils.STAGE_SECONDS.time(stage=f"index_{name}"):
+                article_index.add_article(article)
+        key = self.kvstore._get_key(article["id"])
+        val = self.kvstore._get_val()
+        self.kvstore[key] = val
+        ARTICLES.inc(outcome=outcome)
+        logger.info(f"Processed article with id {key}")
 
     def forward_pass(self, article: dict):
         try:
             doc = self.spacy(article["text"])
-            article["entity_labels"] = self.entity_labels(doc)
-            pos_tag_entities = self.pos_tag_entities(doc)
-            sentiments = self.sentiment(doc)
-            sent_range = [{"start_char": sent.start_char, "end_char": sent.end_char} for sent in doc.sents]
-            sentence_info = utils.join_lsts_dct(pos_tag_entities, sentiments, sent_range)
-            article["sentence_info"] = sentence_info
+            article = self.tag_doc(doc, article)
         except KeyError as e:
             logger.info(f"Skipped article with id {article['id']} because of missing text")
         return article
 
+    def forward_passes(self, articles: List[dict]) -> List[dict]:
+        """forward_pass of several articles, parsed in one nlp.pipe call and with their sentences in shared sentiment batches."""
+        with self.model_lock:
+            docs = list(self.spacy.pipe([article["text"] for article in articles], batch_size=len(articles)))
+            sentiments = self.sentiment_docs(docs)
+            return [
+                self.tag_doc(doc, article, sentiments=doc_sentiments)
+                for doc, article, doc_sentiments in zip(docs, articles, sentiments)
+            ]
+
+    def tag_doc(self, doc, article: dict, sentiments: list = None):
+        article["entity_labels"], pos_tag_entities, sent_range = self.extract_features(doc)
+        if sentiments is None:
+            sentiments = self.sentiment(doc)
+        sentence_info = utils.join_lsts_dct(pos_tag_entities, sentiments, sent_range)
+        article["sentence_info"] = sentence_info
+        return article
+
+    @utils.timeit
     def save(self, article: dict, path: Path = Path("data/articles.jl")):
         with open(path, "a") as jsonl_file:
             json.dump(article, jsonl_file)
             jsonl_file.write("\n")
 
 
-class SoccerArticles:
-    def __init__(self, s3_client: boto3.client):
+class SoccerArticles(SoccerText):
+    def __init__(self, s3_client, force_sync: bool = False):
         super().__init__(s3_client)
-        self.sync_data(s3_folder=Path("data/articles.jl"))
-        self.articles = self.get_data(path=Path("data/articles.jl"))
+        # built from the shards only, apart from the articles.jl the tagger appends to and cuts them from,
+        # otherwise every reload would append the last shard to it again and the next shard repeat it
+        self.data_path = Path(settings.TAGGED_DIR) / "articles.jl"
+        with utils.timer(self.load_times, "sync_data"):
+            # only shards missing locally are downloaded, and appended to the reader's articles.jl
+            self.sync_data(s3_folder=Path(settings.TAGGED_DIR), local=Path(settings.TAGGED_DIR), ingest=False, force=force_sync)
+            data_utils.append_shards(Path(settings.TAGGED_DIR), self.data_path)
+        with utils.timer(self.load_times, "load_store"):
+            # only the lines appended since the last start are parsed
+            self.store = store_utils.ArticleStore(self.data_path, Path("data/store"))
+            self.store.refresh()
+        with utils.timer(self.load_times, "update_indexes"):
+            self.mentions = index_utils.MentionIndex("data/mentions.db")
+            self.aggregates = index_utils.SentimentAggregates("data/aggregates.db")
+            self.matches = index_utils.MatchCatalogue("data/matches.db")
+            self.update_indexes()
+
+    @property
+    def articles(self):
+        return (self.store.get(i) for i in self.store.rows())
+
+    @property
+    def data_version(self) -> str:
+        """
+        Changes whenever articles are stored or the tagger commits to an index, for keying responses
+        computed from them. The index versions only compare within this instance's connections.
+        """
+        indexes = [self.mentions, self.aggregates, self.matches]
+        index_versions = [data_utils.data_version(article_index.conn) for article_index in indexes]
+        return "-".join(map(str, [len(self.store), self.store.scanned["offset"], *index_versions]))
 
-    def player_mentions(self):
-        res = jmespath.search()
+    def update_indexes(self, commit_every: int = 1000) -> int:
+        """Adds the stored articles missing from an index, checked by id so indexed articles are never rebuilt."""
+        indexes = [self.mentions, self.aggregates, self.matches]
+        added = 0
+        for i in self.store.rows():
+            article_id = self.store.article_ids[i]
+            missing = [article_index for article_index in indexes if article_id not in article_index]
+            if not missing:
+                continue
+            article = self.store.get(i)
+            for article_index in missing:
+                article_index.add_article(article)
+            added += 1
+            if added % commit_every == 0:
+                for article_index in indexes:
+                    article_index.commit()
+        for article_index in indexes:
+            article_index.commit()
+        logger.info(f"indexed {added} new articles")
+        return added
+
+    def player_mentions(self, player: str, cursor: int = 0, limit: int = 50):
+        res = self.mentions.search(player, cursor=cursor, limit=limit)
+        return res
+
+    def players(self, teams: List[str], limit: int = 50) -> Dict[str, List[dict]]:
+        res = {team: self.matches.roster(team, limit=limit) for team in teams}
+        return res
+
+    def games(self, team: str = None, home_team: str = None, away_team: str = None, match_date: str = None, limit: int = 50):
+        res = self.matches.matches(team=team, home_team=home_team, away_team=away_team, match_date=match_date, limit=limit)
+        return res
+
+    def sentiment_series(self, name: str, kind: str = "entity", start: str = None, end: str = None, granularity: str = "month"):
+        # a player is every entity matching the name, as in player_mentions, a team every team the name is an alias of,
+        # as in players and games
+        if kind == "entity":
+            keys = self.mentions.entities(name)
+        else:
+            keys = self.matches.team_keys(name) or [index_utils.normalise_entity(name)]
+        res = self.aggregates.series(kind, keys, start=start, end=end, granularity=granularity)
         return res
 
-    # TODO jmespaths or jq to specific articles to ask for, to hand to whatever stuff on top
+    def query(
+        self,
+        expression: str,
+        team: str = None,
+        start: str = None,
+        end: str = None,
+        cursor: int = 0,
+        limit: int = 50,
+    ) -> dict:
+        """
+        Evaluates a JMESPath expression on one article at a time, keeping the articles it gives a
+        non empty result for. With a team or match date range, only the articles of the matching games
+        are read from the store. The cursor is a byte offset in articles.jl, pass the returned next_cursor
+        to get the next page, which is None on the last page.
+        """
+        compiled = compile_query(expression)
+        article_ids = None
+        if team is not None or start is not None or end is not None:
+            article_ids = self.matches.article_ids(team=team, start=start, end=end)
+        results = []
+        for i in self.store.rows(article_ids, after=cursor):
+            value = compiled.search(self.store.get(i))
+            if value is None or value == [] or value == {}:
+                continue
+            results.append({"article_id": self.store.article_ids[i], "value": value})
+            if len(results) == limit:
+                return {"results": results, "next_cursor": self.store.next_offset(i)}
+        return {"results": results, "next_cursor": None}
 
 
 if __name__ == "__main__":
-    s3_client = boto3.client("s3")
+    s3_client = transfer_utils.get_s3_client()
     tagger = SoccerTagger(s3_client)
     tagger.forward()
     self = tagger
@@ -16,6 +16,42 @@ class Settings(BaseSettings):
     AWS_ACCESS_KEY_ID: SecretStr = "AWS_ACCESS_KEY_ID"
     AWS_SECRET_ACCESS_KEY: SecretStr = "AWS_SECRET_ACCESS_KEY"
     FOLDER_UPDATE_FREQ: timedelta = timedelta(days=1)
+    WARM_UP_ON_STARTUP: bool = True
+    S3_ENDPOINT_URL: str = None
+    S3_MAX_POOL_CONNECTIONS: int = 32
+    S3_MAX_CONCURRENCY: int = 16
+    S3_MULTIPART_CHUNKSIZE: int = 8 * 1024 * 1024
+    S3_MAX_RETRIES: int = 5
+    INGEST_MAX_WORKERS: int = 4
+    SENTIMENT_MODEL: str = "distilbert-base-uncased-finetuned-sst-2-english"
+    SENTIMENT_MODEL_REVISION: str = "main"
+    SENTIMENT_BACKEND: str = "pytorch"
+    SENTIMENT_NUM_THREADS: int = None
+    SENTIMENT_BATCH_SIZE: int = 32
+    SENTIMENT_MAX_TOKENS: int = 4096
+    SENTIMENT_CACHE: bool = True
+    SENTIMENT_CACHE_PATH: str = "data/sentiment_cache.db"
+    SENTIMENT_CACHE_MEMORY_SIZE: int = 100_000
+    SENTIMENT_CACHE_MAX_ROWS: int = 5_000_000
+    SPACY_MODEL: str = "en_core_web_sm"
+    SPACY_STAGES: List[str] = ["ner", "pos", "sents"]
+    SPACY_BATCH_SIZE: int = 64
+    SPACY_N_PROCESS: int = 1
+    DOC_CACHE: bool = False
+    DOC_CACHE_PATH: str = "data/doc_cache.db"
+    COLUMNAR_OUTPUT: bool = False
+    COLUMNAR_ROW_GROUP_SIZE: int = 1000
+    COLUMNAR_PARTITION_BY: str = "match_month"
+    PROFILE_DIR: str = "data/profiles"
+    FORWARD_WORKERS: int = 1
+    SHARD_DIR: str = "data/shards"
+    TAGGED_DIR: str = "data/tagged"
+    QUERY_CACHE_SIZE: int = 256
+    TAG_MAX_BATCH_SIZE: int = 32
+    TAG_MAX_WAIT_MS: float = 10
+    TAG_MAX_QUEUE: int = 1000
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESPONSE_CACHE_TTL: float = 300
 
 
 settings = Settings()
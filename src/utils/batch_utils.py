@@ -0,0 +1,84 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+from utils import metrics_utils, utils
+
+logger = utils.get_logger(f"{__name__}.log")
+
+QUEUE_DEPTH = metrics_utils.registry.gauge("batcher_queue_depth", "Items waiting for a batch", ["batcher"])
+LATENCY_SECONDS = metrics_utils.registry.histogram("batcher_latency_seconds", "Time from submit to result, per item", ["batcher"])
+WAIT_SECONDS = metrics_utils.registry.histogram("batcher_wait_seconds", "Time from submit to the start of its batch", ["batcher"])
+
+
+class MicroBatcher:
+    """
+    Coalesces items submitted from many callers into batches for one batch function, run on a
+    dedicated thread. A batch starts once it holds max_batch_size items, or max_wait_ms after its
+    first item arrived, whichever comes first, so a lone request waits at most max_wait_ms extra.
+
+    params:
+    - name: label of the batcher in the metrics
+    - fn: takes a list of items and returns a list of results in the same order
+    - max_batch_size: most items per call of fn
+    - max_wait_ms: longest a batch waits to fill up
+    - max_queue: items waiting beyond this are refused with queue.Full, instead of growing the latency of all
+    """
+
+    def __init__(
+        self, name: str, fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 32, max_wait_ms: float = 10, max_queue: int = 1000
+    ):
+        self.name = name
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queues item and returns a future of its result, raises queue.Full when the queue is full."""
+        future: Future = Future()
+        self.queue.put_nowait((item, future, time.perf_counter()))
+        QUEUE_DEPTH.set(self.queue.qsize(), batcher=self.name)
+        return future
+
+    def _next_batch(self) -> list:
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        QUEUE_DEPTH.set(self.queue.qsize(), batcher=self.name)
+        return batch
+
+    def _run(self):
+        while True:
+            # callers that went away cancel their future, their items are dropped
+            batch = [
+                (item, future, submitted) for item, future, submitted in self._next_batch() if future.set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            metrics_utils.BATCH_SIZE.observe(len(batch), stage=self.name)
+            for _, _, submitted in batch:
+                WAIT_SECONDS.observe(started - submitted, batcher=self.name)
+            try:
+                results = self.fn([item for item, _, _ in batch])
+            except Exception as e:
+                logger.info(f"batch of {len(batch)} failed in {self.name}: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+            for (_, future, submitted), result in zip(batch, results):
+                LATENCY_SECONDS.observe(finished - submitted, batcher=self.name)
+                future.set_result(result)
@@ -0,0 +1,203 @@
+import hashlib
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cachetools import LRUCache, TTLCache
+
+from utils import data_utils, metrics_utils, utils
+
+logger = utils.get_logger(f"{__name__}.log")
+
+
+def normalise_text(text: str) -> str:
+    # the tokenizer splits on whitespace, so texts differing only in whitespace get the same result
+    return " ".join(text.split())
+
+
+class SentimentCache:
+    """
+    Content addressed cache of sentence sentiment results, an in memory LRU in front of sqlite.
+
+    Keys hash the model id together with the normalised sentence, so changing model or revision
+    never returns stale results. The sqlite tier is bounded to max_rows, evicting least recently used.
+
+    params:
+    - filename: sqlite file of the disk tier
+    - model_id: model name and revision the results belong to
+    - memory_size: number of results kept in memory
+    - max_rows: number of results kept on disk
+    """
+
+    def __init__(self, filename: str, model_id: str, memory_size: int = 100_000, max_rows: int = 5_000_000):
+        self.model_id = model_id
+        self.max_rows = max_rows
+        self.memory = LRUCache(maxsize=memory_size)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._inserts = 0
+        self._lock = threading.Lock()
+        self.conn = data_utils.connect(filename, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sentiments (key text PRIMARY KEY, label text, score real, last_used integer)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sentiments_last_used ON sentiments (last_used)")
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_id}\0{normalise_text(text)}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[dict]]:
+        """Cached results aligned with texts, None where a text is not cached."""
+        keys = [self.key(text) for text in texts]
+        results: List[Optional[dict]] = [None] * len(texts)
+        with self._lock:
+            on_disk: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                result = self.memory.get(key)
+                if result is not None:
+                    results[i] = result
+                    self.memory_hits += 1
+                    metrics_utils.CACHE_LOOKUPS.inc(cache="sentiment", result="memory_hit")
+                else:
+                    on_disk.setdefault(key, []).append(i)
+            if on_disk:
+                now = int(time.time())
+                found = {}
+                for chunk in utils.chunks(on_disk, 500):
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = self.conn.execute(f"SELECT key, label, score FROM sentiments WHERE key IN ({placeholders})", chunk)
+                    found.update({key: {"label": label, "score": score} for key, label, score in rows})
+                self.conn.executemany("UPDATE sentiments SET last_used = ? WHERE key = ?", ((now, key) for key in found))
+                self.conn.commit()
+                for key, indices in on_disk.items():
+                    result = found.get(key)
+                    for i in indices:
+                        results[i] = result
+                    if result is not None:
+                        self.memory[key] = result
+                        self.disk_hits += len(indices)
+                        metrics_utils.CACHE_LOOKUPS.inc(len(indices), cache="sentiment", result="disk_hit")
+                    else:
+                        self.misses += len(indices)
+                        metrics_utils.CACHE_LOOKUPS.inc(len(indices), cache="sentiment", result="miss")
+        return results
+
+    def put_many(self, texts: List[str], results: List[dict]):
+        now = int(time.time())
+        rows = {self.key(text): result for text, result in zip(texts, results)}
+        with self._lock:
+            for key, result in rows.items():
+                self.memory[key] = result
+            self.conn.executemany(
+                "REPLACE INTO sentiments (key, label, score, last_used) VALUES (?,?,?,?)",
+                ((key, result["label"], result["score"], now) for key, result in rows.items()),
+            )
+            self.conn.commit()
+            self._inserts += len(rows)
+            # counting rows on every put would cost more than the inserts, so evict in rounds
+            if self._inserts >= max(self.max_rows // 100, 1):
+                self._inserts = 0
+                self.evict()
+
+    def evict(self):
+        n_rows = self.conn.execute("SELECT COUNT(*) FROM sentiments").fetchone()[0]
+        if n_rows > self.max_rows:
+            self.conn.execute(
+                "DELETE FROM sentiments WHERE key IN (SELECT key FROM sentiments ORDER BY last_used LIMIT ?)",
+                (n_rows - self.max_rows,),
+            )
+            self.conn.commit()
+            logger.info(f"evicted {n_rows - self.max_rows} sentiment results")
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+class DocCache:
+    """
+    Parsed spacy docs keyed by article id and model version, stored as DocBin bytes in sqlite, so
+    feature extractors can rerun over earlier parses without the parser.
+
+    params:
+    - filename: sqlite file
+    - nlp: the pipeline the docs are parsed with, its name, version and components make the version
+    """
+
+    def __init__(self, filename: str, nlp):
+        self.nlp = nlp
+        self.version = f"{nlp.meta['name']}-{nlp.meta['version']}-{'+'.join(nlp.pipe_names)}"
+        self.conn = data_utils.connect(filename, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs (article_id text, version text, doc blob, PRIMARY KEY (article_id, version))"
+        )
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def get(self, article_id: str):
+        from spacy.tokens import DocBin
+
+        row = self.conn.execute("SELECT doc FROM docs WHERE article_id = ? AND version = ?", (article_id, self.version)).fetchone()
+        if row is None:
+            metrics_utils.CACHE_LOOKUPS.inc(cache="doc", result="miss")
+            return None
+        metrics_utils.CACHE_LOOKUPS.inc(cache="doc", result="hit")
+        return next(DocBin().from_bytes(row[0]).get_docs(self.nlp.vocab))
+
+    def put(self, article_id: str, doc):
+        from spacy.tokens import DocBin
+
+        doc_bin = DocBin(docs=[doc])
+        self.conn.execute("REPLACE INTO docs VALUES (?,?,?)", (article_id, self.version, doc_bin.to_bytes()))
+
+    def commit(self):
+        self.conn.commit()
+
+
+class ResponseCache:
+    """
+    Rendered response bodies with their ETag, bounded by total bytes and by age.
+
+    Callers key entries by the normalised query and the version of the data it was answered from,
+    so a reload never serves stale bodies, and the ETag of a cached body answers If-None-Match
+    without recomputing it.
+
+    params:
+    - max_bytes: total size of the cached bodies
+    - ttl: seconds an entry is kept
+    """
+
+    def __init__(self, max_bytes: int = 64 * 2 ** 20, ttl: float = 300):
+        self.entries = TTLCache(maxsize=max_bytes, ttl=ttl, getsizeof=lambda entry: len(entry[0]))
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key: tuple, render: Callable[[], bytes]) -> Tuple[bytes, str]:
+        """The cached (body, etag) of key, rendered and cached first on a miss."""
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry is not None:
+            metrics_utils.CACHE_LOOKUPS.inc(cache="response", result="hit")
+            return entry
+        metrics_utils.CACHE_LOOKUPS.inc(cache="response", result="miss")
+        body = render()
+        entry = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+        # bodies larger than the whole cache are served but not kept
+        if len(body) <= self.max_bytes:
+            with self._lock:
+                self.entries[key] = entry
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
@@ -0,0 +1,146 @@
+"""Columnar (parquet) output of tagged articles, as flat tables that can be scanned without parsing json.
+
+Tables, all partitioned by match month or season:
+- articles: one row per article
+- sentences: one row per sentence with its char range and sentiment
+- sentence_tags: one row per ADV/ADJ/ENT tag of a sentence
+"""
+from pathlib import Path
+from typing import Dict, List
+
+from utils import utils
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = utils.get_logger(f"{__name__}.log")
+
+ARTICLE_FIELDS = ["id", "match_date", "home_team", "away_team", "author", "stadium", "headline", "link"]
+
+
+def schemas() -> Dict[str, "pa.Schema"]:
+    string = pa.string()
+    return {
+        "articles": pa.schema([(field, string) for field in ARTICLE_FIELDS] + [("partition", string)]),
+        "sentences": pa.schema(
+            [
+                ("article_id", string),
+                ("idx", pa.int32()),
+                ("start_char", pa.int32()),
+                ("end_char", pa.int32()),
+                ("sentiment_label", string),
+                ("sentiment_score", pa.float32()),
+                ("partition", string),
+            ]
+        ),
+        "sentence_tags": pa.schema(
+            [
+                ("article_id", string),
+                ("idx", pa.int32()),
+                ("tag", string),
+                ("position", pa.int32()),
+                ("value", string),
+                ("partition", string),
+            ]
+        ),
+    }
+
+
+def partition_value(match_date: str, partition_by: str = "match_month") -> str:
+    """
+    params:
+    - match_date: iso date, e.g. 2020-02-23
+    - partition_by: "match_month" (2020-02) or "season" (2019-2020, seasons start in July)
+    """
+    if not match_date:
+        return "unknown"
+    if partition_by == "season":
+        year, month = int(match_date[:4]), int(match_date[5:7])
+        start = year if month >= 7 else year - 1
+        return f"{start}-{start + 1}"
+    return match_date[:7]
+
+
+def article_rows(article: dict, partition_by: str = "match_month"):
+    """Flattens a tagged article into its rows of the articles, sentences and sentence_tags tables."""
+    partition = partition_value(article.get("match_date"), partition_by)
+    article_id = article["id"]
+    article_row = {field: article.get(field) for field in ARTICLE_FIELDS}
+    article_row["partition"] = partition
+    sentence_rows, tag_rows = [], []
+    for idx, (pos_tags, sentiment, sent_range) in enumerate(article.get("sentence_info", [])):
+        sentence_rows.append(
+            {
+                "article_id": article_id,
+                "idx": idx,
+                "start_char": sent_range["start_char"],
+                "end_char": sent_range["end_char"],
+                "sentiment_label": sentiment["sentiment"]["label"],
+                "sentiment_score": sentiment["sentiment"]["score"],
+                "partition": partition,
+            }
+        )
+        for tag, values in pos_tags.items():
+            for position, value in enumerate(values):
+                tag_rows.append(
+                    {"article_id": article_id, "idx": idx, "tag": tag, "position": position, "value": value, "partition": partition}
+                )
+    return article_row, sentence_rows, tag_rows
+
+
+class ColumnarSink:
+    """
+    Buffers tagged articles and writes them as parquet row groups, one file per table, partition and flush.
+
+    params:
+    - path: root folder, holding a dataset folder per table
+    - row_group_size: number of articles buffered before a flush
+    - partition_by: "match_month" or "season"
+    """
+
+    def __init__(self, path: Path = Path("data/columnar"), row_group_size: int = 1000, partition_by: str = "match_month"):
+        if pa is None:
+            raise ImportError("pyarrow is required for columnar output, install the parquet extra")
+        self.path = path
+        self.row_group_size = row_group_size
+        self.partition_by = partition_by
+        self.schemas = schemas()
+        self.n_articles = 0
+        self.buffers: Dict[str, List[dict]] = {name: [] for name in self.schemas}
+
+    def add(self, article: dict):
+        article_row, sentence_rows, tag_rows = article_rows(article, partition_by=self.partition_by)
+        self.buffers["articles"].append(article_row)
+        self.buffers["sentences"].extend(sentence_rows)
+        self.buffers["sentence_tags"].extend(tag_rows)
+        self.n_articles += 1
+        if self.n_articles >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self.n_articles == 0:
+            return
+        for name, rows in self.buffers.items():
+            if not rows:
+                continue
+            schema = self.schemas[name]
+            table = pa.Table.from_pydict({field: [row[field] for row in rows] for field in schema.names}, schema=schema)
+            pq.write_to_dataset(table, root_path=str(self.path / name), partition_cols=["partition"])
+        logger.info(f"wrote {self.n_articles} articles to {str(self.path)}")
+        self.n_articles = 0
+        self.buffers = {name: [] for name in self.schemas}
+
+    def close(self):
+        self.flush()
+
+
+def read_table(name: str, path: Path = Path("data/columnar"), columns: List[str] = None, filters: list = None):
+    """
+    Reads a table as a pandas DataFrame, e.g.
+    read_table("sentences", filters=[("partition", ">=", "2020-01")], columns=["article_id", "sentiment_score"])
+    """
+    return pq.read_table(str(path / name), columns=columns, filters=filters).to_pandas()
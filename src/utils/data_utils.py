@@ -1,25 +1,100 @@
-from typing import List
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 import json
 import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import mmap
 from pathlib import Path
 import os
-from boto3 import client
+import shutil
+import tempfile
 import sqlite3
 
-from utils import utils
+from settings import settings
+from utils import transfer_utils, utils
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = utils.get_logger(f"{__name__}.log")
 
+# bump to renormalise files that were normalised by an older normalise_record
+INGEST_VERSION = 1
+# lists the shards of a shard folder in order, see cut_shard
+SHARD_MANIFEST = "manifest.json"
+
+# orjson is several times faster than json when it is installed, both take bytes
+json_loads: Callable = orjson.loads if orjson is not None else json.loads
+
 
-def download_dir(prefix: str, local: Path, bucket: str, s3_client: client):
+def read_jsonl(path: Path, fields: List[str] = None, loads: Callable = None, use_mmap: bool = False) -> Iterator[dict]:
     """
+    Lazily reads json lines, one record at a time.
+
     params:
-    - prefix: pattern to match in s3
-    - local: local path to folder in which to place files
-    - bucket: s3 bucket with target contents
-    - s3_client: initialized s3 client object
+    - path: jsonl file or folder of .jl files
+    - fields: only keep these keys of each record, e.g. leave out "text" when only metadata is needed
+    - loads: json parser for a single line, defaults to orjson when installed
+    - use_mmap: read through a memory map instead of buffered file reads
     """
-    keys = {}
+    loads = loads or json_loads
+    paths = sorted(path.glob("*.jl")) if path.is_dir() else [path]
+    for file_path in paths:
+        with open(file_path, "rb") as jsonl_file:
+            if use_mmap and os.fstat(jsonl_file.fileno()).st_size > 0:
+                with mmap.mmap(jsonl_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    yield from _parse_lines(iter(mm.readline, b""), fields, loads)
+            else:
+                yield from _parse_lines(jsonl_file, fields, loads)
+
+
+def _parse_lines(lines: Iterable[bytes], fields: List[str], loads: Callable) -> Iterator[dict]:
+    for line in lines:
+        if not line.strip():
+            continue
+        dct = loads(line)
+        if fields is not None:
+            dct = {field: dct[field] for field in fields if field in dct}
+        yield dct
+
+
+def read_jsonl_at(path: Path, offset: int = 0, loads: Callable = None) -> Iterator[Tuple[int, int, dict]]:
+    """
+    Lazily reads the json lines of a single file from a byte offset, as (offset, next offset, record),
+    so a later read can resume at next offset. Stops at a last line that is still being written.
+    """
+    loads = loads or json_loads
+    with open(path, "rb") as jsonl_file:
+        jsonl_file.seek(offset)
+        for line in jsonl_file:
+            if not line.endswith(b"\n"):
+                return
+            next_offset = offset + len(line)
+            if line.strip():
+                yield offset, next_offset, loads(line)
+            offset = next_offset
+
+
+def read_jsonl_offsets(path: Path, offsets: Iterable[int], loads: Callable = None) -> Iterator[Tuple[int, int, dict]]:
+    """Reads the json lines starting at offsets of a single file, as (offset, next offset, record)."""
+    loads = loads or json_loads
+    with open(path, "rb") as jsonl_file:
+        for offset in offsets:
+            jsonl_file.seek(offset)
+            line = jsonl_file.readline()
+            yield offset, offset + len(line), loads(line)
+
+
+def list_objects(prefix: str, bucket: str, s3_client) -> Dict[str, dict]:
+    """
+    Lists all objects under a prefix, following continuation tokens.
+
+    returns: dict of key to its ETag, Size and LastModified
+    """
+    objects = {}
     next_token = ""
     base_kwargs = {
         "Bucket": bucket,
@@ -30,42 +105,353 @@ def download_dir(prefix: str, local: Path, bucket: str, s3_client: client):
         if next_token != "":
             kwargs.update({"ContinuationToken": next_token})
         results = s3_client.list_objects_v2(**kwargs)
-        contents = results.get("Contents")
-        for i in contents:
-            foreign_key = i.get("Key")
-            local_key = local / Path(foreign_key.lstrip(prefix + "/"))
-            keys[foreign_key] = local_key
+        for i in results.get("Contents", []):
+            objects[i["Key"]] = {
+                "ETag": i.get("ETag"),
+                "Size": i.get("Size"),
+                "LastModified": str(i.get("LastModified")),
+            }
         next_token = results.get("NextContinuationToken")
+    return objects
+
+
+def local_path(foreign_key: str, prefix: str, local: Path) -> Path:
+    # a prefix naming a single object maps to local itself
+    relative = foreign_key[len(prefix) :].lstrip("/") if foreign_key.startswith(prefix) else foreign_key
+    return local / relative if relative else local
 
-    for foreign_key, local_key in keys.items():
-        s3_client.download_file(bucket, foreign_key, str(local_key))
-        logger.info(f"downloaded {str(foreign_key)}")
 
+@utils.timeit
+def download_dir(prefix: str, local: Path, bucket: str, s3_client):
+    """
+    params:
+    - prefix: pattern to match in s3
+    - local: local path to folder in which to place files
+    - bucket: s3 bucket with target contents
+    - s3_client: initialized s3 client object
+
+    returns: downloaded keys and (key, error) for keys that failed
+    """
+    objects = list_objects(prefix, bucket, s3_client)
+    keys = {foreign_key: local_path(foreign_key, prefix, local) for foreign_key in objects}
+    sizes = {foreign_key: meta["Size"] for foreign_key, meta in objects.items()}
+    done, failed = transfer_utils.download_many(keys, bucket=bucket, s3_client=s3_client, sizes=sizes)
+    return done, failed
+
+
+@utils.timeit
+def sync_dir(
+    prefix: str,
+    local: Path,
+    bucket: str,
+    s3_client,
+    manifest_path: Path = None,
+    delete: bool = True,
+    min_interval: timedelta = None,
+) -> Tuple[List[Path], List[Path]]:
+    """
+    Downloads only objects that are new or changed since the last sync, judged by a local manifest
+    of ETag, Size and LastModified per key.
+
+    params:
+    - prefix: pattern to match in s3
+    - local: local path to folder (or file, for a single object) to sync into
+    - bucket: s3 bucket with target contents
+    - s3_client: initialized s3 client object
+    - manifest_path: where to keep the manifest, defaults to a hidden file next to local
+    - delete: delete local copies of objects removed from s3, otherwise only flag them in the manifest
+    - min_interval: skip the listing entirely if the last sync is more recent than this
+
+    returns: local paths that were downloaded and local paths whose objects were removed
+    """
+    manifest_path = manifest_path or local.parent / f".{local.name}.manifest.json"
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {"synced_at": None, "objects": {}}
+    if min_interval is not None and manifest["synced_at"] is not None:
+        if datetime.now() - datetime.fromisoformat(manifest["synced_at"]) < min_interval:
+            logger.info(f"skipping sync of {prefix}, last synced at {manifest['synced_at']}")
+            return [], []
 
-def process_file(path: Path):
-    def add_id(lst_dct: List[dict]):
-        for dct in lst_dct:
-            dct["id"] = hashlib.md5(str(dct).encode("utf-8")).hexdigest()
-            if "text" in dct.keys():
-                if isinstance(dct["text"], list):
-                    dct["text"] = "\n\n".join(dct["text"])
-        return lst_dct
+    known = manifest["objects"]
+    remote = list_objects(prefix, bucket, s3_client)
+    keys = {}
+    for foreign_key, meta in remote.items():
+        local_key = local_path(foreign_key, prefix, local)
+        previous = known.get(foreign_key)
+        if previous is not None and previous["ETag"] == meta["ETag"] and previous["Size"] == meta["Size"] and local_key.exists():
+            continue
+        keys[foreign_key] = local_key
+
+    sizes = {foreign_key: remote[foreign_key]["Size"] for foreign_key in keys}
+    done, failed = transfer_utils.download_many(keys, bucket=bucket, s3_client=s3_client, sizes=sizes)
+    # failed keys stay out of the manifest, so the next sync retries them
+    changed, removed = [], []
+    for foreign_key in done:
+        known[foreign_key] = remote[foreign_key]
+        changed.append(keys[foreign_key])
+
+    for foreign_key in [key for key in known if key not in remote]:
+        local_key = local_path(foreign_key, prefix, local)
+        if delete:
+            if local_key.is_file():
+                local_key.unlink()
+            del known[foreign_key]
+            logger.info(f"deleted {str(local_key)}, removed from s3")
+        elif not known[foreign_key].get("Removed"):
+            known[foreign_key]["Removed"] = True
+            logger.info(f"flagged {str(local_key)}, removed from s3")
+        removed.append(local_key)
 
+    manifest["synced_at"] = datetime.now().isoformat()
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_open(manifest_path) as manifest_file:
+        json.dump(manifest, manifest_file)
+    return changed, removed
+
+
+@contextmanager
+def atomic_open(path: Path, mode: str = "w"):
+    """
+    Writes to a temp file next to path and renames it over path once the block finishes, so readers
+    and crashes never see a half written file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
     try:
-        lst_dct = [json.loads(line) for line in open(path, "r").read().split("\n") if line]
-        lst_dct = add_id(lst_dct)
-        # path.rename(path.with_suffix(".jl"))
-        with open(path, "w") as jsonl_file:
-            for entry in lst_dct:
-                json.dump(entry, jsonl_file)
-                jsonl_file.write("\n")
-    except TypeError as e:
-        logger.info(f"failed for {str(path)} because of: {e}, which might be an already processed file")
+        with os.fdopen(fd, mode) as tmp_file:
+            yield tmp_file
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        # mkstemp creates the file private, keep the permissions of the file being replaced
+        os.chmod(tmp_path, path.stat().st_mode & 0o777 if path.exists() else 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def load_shard_manifest(folder: Path) -> dict:
+    manifest_path = folder / SHARD_MANIFEST
+    return json.loads(manifest_path.read_text()) if manifest_path.exists() else {"shards": []}
+
+
+def published_offset(source: Path, folder: Path) -> int:
+    """
+    Byte offset in source up to which its lines are in shards. It is kept next to source, never in the
+    manifest, which is synced from s3 and so may describe the articles.jl of another host, and it only
+    counts for the file it was recorded for: a replaced source starts over at 0.
+    """
+    state_path = source.parent / f".{source.name}.published.json"
+    if not source.exists():
+        return 0
+    stat = source.stat()
+    if state_path.exists():
+        state = json.loads(state_path.read_text())
+        if state["inode"] == stat.st_ino and state["offset"] <= stat.st_size:
+            return state["offset"]
+        logger.info(f"{str(source)} was replaced since its last shard, publishing it from the start")
+        return 0
+    # manifests written before the offset was kept locally, trusted only if their last shard is the tail of source
+    manifest = load_shard_manifest(folder)
+    offset = manifest.get("published_to", 0)
+    if not offset or not manifest["shards"] or offset > stat.st_size:
+        return 0
+    last_shard = folder / manifest["shards"][-1]["name"]
+    if not last_shard.exists() or last_shard.stat().st_size > offset:
+        return 0
+    data = last_shard.read_bytes()
+    with open(source, "rb") as source_file:
+        source_file.seek(offset - len(data))
+        return offset if source_file.read(len(data)) == data else 0
+
+
+def cut_shard(source: Path, folder: Path, name: str) -> Optional[dict]:
+    """
+    Copies the lines appended to source since the last shard into a new, immutable shard file in
+    folder and lists it in the folder's manifest, see published_offset.
+
+    params:
+    - source: append only jsonl file, e.g. data/articles.jl
+    - folder: shard folder, holding the shards and manifest.json
+    - name: file name of the new shard
+
+    returns: the manifest entry of the new shard, None if nothing was appended
+    """
+    manifest = load_shard_manifest(folder)
+    start = published_offset(source, folder)
+    size = source.stat().st_size if source.exists() else 0
+    if size <= start:
+        return None
+    with open(source, "rb") as source_file:
+        source_file.seek(start)
+        data = source_file.read(size - start)
+    # a line still being written goes into the next shard
+    data = data[: data.rfind(b"\n") + 1]
+    if not data:
+        return None
+    folder.mkdir(parents=True, exist_ok=True)
+    with atomic_open(folder / name, "wb") as shard_file:
+        shard_file.write(data)
+    shard = {"name": name, "articles": data.count(b"\n"), "bytes": len(data), "created_at": datetime.now().isoformat()}
+    manifest["shards"].append(shard)
+    manifest.pop("published_to", None)
+    with atomic_open(folder / SHARD_MANIFEST) as manifest_file:
+        json.dump(manifest, manifest_file)
+    # recorded last, a crash before it publishes the same lines again rather than never
+    with atomic_open(source.parent / f".{source.name}.published.json") as state_file:
+        json.dump({"offset": start + len(data), "inode": source.stat().st_ino}, state_file)
+    logger.info(f"cut shard {name} with {shard['articles']} articles")
+    return shard
+
+
+def leading_shards(folder: Path, shards: List[str], target: Path) -> Optional[List[str]]:
+    """The shards target is made of, in order, or None if it holds anything else."""
+    if not target.exists():
+        return []
+    matched, offset, size = [], 0, target.stat().st_size
+    with open(target, "rb") as target_file:
+        for name in shards:
+            if offset == size:
+                break
+            data = (folder / name).read_bytes()
+            if target_file.read(len(data)) != data:
+                return None
+            matched.append(name)
+            offset += len(data)
+    return matched if offset == size else None
+
+
+def append_shards(folder: Path, target: Path) -> List[str]:
+    """
+    Appends the shards listed in the folder's manifest that target doesn't have yet, in manifest order,
+    and returns their names.
+
+    A target without a record of its shards is matched against them first, the shards it starts with
+    are recorded as appended. One holding anything else, e.g. a full copy downloaded before shards
+    existed, is replaced by all of them, never before there are shards to replace it with.
+    """
+    state_path = target.parent / f".{target.name}.shards.json"
+    shards = [shard["name"] for shard in load_shard_manifest(folder)["shards"] if (folder / shard["name"]).exists()]
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if state_path.exists():
+        appended = json.loads(state_path.read_text())
+    elif not shards:
+        # nothing to tell what target holds yet, it is left as it is
+        return []
+    else:
+        appended = leading_shards(folder, shards, target)
+        if appended is None:
+            # the shards hold every article from the first run on, the first shard is the full history
+            with atomic_open(target, "wb") as target_file:
+                for name in shards:
+                    with open(folder / name, "rb") as shard_file:
+                        shutil.copyfileobj(shard_file, target_file)
+            logger.info(f"rebuilt {str(target)} from {len(shards)} shards")
+            with atomic_open(state_path) as state_file:
+                json.dump(shards, state_file)
+            return shards
+        with atomic_open(state_path) as state_file:
+            json.dump(appended, state_file)
+    new = [name for name in shards if name not in set(appended)]
+    for name in new:
+        with open(folder / name, "rb") as shard_file, open(target, "ab") as target_file:
+            shutil.copyfileobj(shard_file, target_file)
+            target_file.flush()
+            os.fsync(target_file.fileno())
+        appended.append(name)
+        with atomic_open(state_path) as state_file:
+            json.dump(appended, state_file)
+    if new:
+        logger.info(f"appended {len(new)} new shards to {str(target)}")
+    return new
+
+
+def normalise_record(dct: dict) -> dict:
+    # records that already have an id are left as is, which makes normalising idempotent
+    if "id" not in dct:
+        dct["id"] = hashlib.md5(str(dct).encode("utf-8")).hexdigest()
+    if isinstance(dct.get("text"), list):
+        dct["text"] = "\n\n".join(dct["text"])
+    return dct
+
+
+def process_file(path: Path) -> int:
+    """
+    Streams a jsonl file through normalise_record and atomically replaces it.
+
+    returns: number of records written
+    """
+    n_records = 0
+    with atomic_open(path) as jsonl_file:
+        for entry in read_jsonl(path):
+            json.dump(normalise_record(entry), jsonl_file)
+            jsonl_file.write("\n")
+            n_records += 1
+    return n_records
+
+
+def _file_state(path: Path) -> dict:
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "version": INGEST_VERSION}
+
+
+def ingest_files(paths: Iterable[Path], manifest_path: Path, max_workers: int = settings.INGEST_MAX_WORKERS) -> List[Path]:
+    """
+    Normalises the files that changed since they were last normalised, in parallel processes.
+    A sidecar manifest records size and mtime of every normalised file, so unchanged files are
+    skipped without being opened.
+
+    params:
+    - paths: jsonl files, all in the folder of manifest_path
+    - manifest_path: sidecar manifest of normalised files
+    - max_workers: number of processes, 1 normalises in this process
+
+    returns: the files that were normalised
+    """
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    todo = [path for path in paths if manifest.get(path.name) != _file_state(path)]
+    if not todo:
+        return []
+
+    if max_workers > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(todo))) as executor:
+            n_records = list(executor.map(process_file, todo))
+    else:
+        n_records = [process_file(path) for path in todo]
+
+    for path, n in zip(todo, n_records):
+        manifest[path.name] = _file_state(path)
+        logger.info(f"normalised {str(path)} with {n} records")
+    with atomic_open(manifest_path) as manifest_file:
+        json.dump(manifest, manifest_file)
+    return todo
+
+
+@utils.timeit
+def ingest_dir(folder: Path, max_workers: int = settings.INGEST_MAX_WORKERS) -> List[Path]:
+    return ingest_files(sorted(folder.glob("*.jl")), manifest_path=folder / ".ingest.json", max_workers=max_workers)
+
+
+def connect(filename: str, check_same_thread: bool = True, timeout: float = 30.0) -> sqlite3.Connection:
+    """
+    sqlite connection in WAL mode, so readers don't block the writer, and writers from several
+    processes wait up to timeout seconds for each other instead of failing with "database is locked".
+    """
+    conn = sqlite3.connect(filename, timeout=timeout, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # in WAL mode this only fsyncs on checkpoints, commits still survive a crashed process
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def data_version(conn: sqlite3.Connection) -> int:
+    """Changes whenever another connection, e.g. of a tagger in another thread or process, commits to the database."""
+    return conn.execute("PRAGMA data_version").fetchone()[0]
 
 
 class kvstore(dict):
     def __init__(self, filename=None, reset=False):
-        self.conn = sqlite3.connect(filename)
+        # shared by the processes of a sharded forward, see SoccerTagger.forward_sharded
+        self.conn = connect(filename)
         if reset:
             self.del_table()
         self.conn.execute("CREATE TABLE IF NOT EXISTS kv (key text unique, value timestamp)")
@@ -105,6 +491,11 @@ class kvstore(dict):
     def items(self):
         return list(self.iteritems())
 
+    @utils.timeit(name="kvstore_snapshot")
+    def key_set(self) -> Set[str]:
+        """Snapshot of all keys, for O(1) membership checks over a whole run."""
+        return set(self.iterkeys())
+
     def __contains__(self, key):
         return self.conn.execute("SELECT 1 FROM kv WHERE key = ?", (key,)).fetchone() is not None
 
@@ -114,6 +505,7 @@ class kvstore(dict):
             raise KeyError(key)
         return item[0]
 
+    @utils.timeit(name="kvstore_set")
     def __setitem__(self, key, value):
         self.conn.execute("REPLACE INTO kv (key, value) VALUES (?,?)", (key, value))
         self.conn.commit()
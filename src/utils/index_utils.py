@@ -0,0 +1,423 @@
+import json
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Tuple
+
+from utils import data_utils, utils
+
+logger = utils.get_logger(f"{__name__}.log")
+
+
+def normalise_entity(text: str) -> str:
+    """Lowercases, strips accents and possessives, so "Jiménez’s" and "jimenez" index the same."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"['’]s\b", "", text.lower())
+    return " ".join(re.findall(r"\w+", text))
+
+
+class MentionIndex:
+    """
+    Inverted index from normalised entity strings to their mentions, backed by sqlite.
+
+    Every ENT of every sentence is a posting with its article id, sentence index, char span and
+    the sentiment of the sentence. A term table maps the single words of entities to the full
+    entities, so "jota" also finds "diogo jota".
+    """
+
+    def __init__(self, filename: str = "data/mentions.db"):
+        self.conn = data_utils.connect(filename, check_same_thread=False)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS mentions (
+                entity text, article_id text, sent_idx integer, start_char integer, end_char integer, label text, score real
+            );
+            CREATE INDEX IF NOT EXISTS mentions_entity ON mentions (entity);
+            CREATE TABLE IF NOT EXISTS terms (term text, entity text, UNIQUE (term, entity));
+            CREATE TABLE IF NOT EXISTS indexed_articles (article_id text PRIMARY KEY);
+            """
+        )
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def commit(self):
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM indexed_articles").fetchone()[0]
+
+    def __contains__(self, article_id: str):
+        return self.conn.execute("SELECT 1 FROM indexed_articles WHERE article_id = ?", (article_id,)).fetchone() is not None
+
+    def add_article(self, article: dict) -> int:
+        """Adds the mentions of a tagged article, unless it is already indexed. Call commit to persist."""
+        if article["id"] in self or "sentence_info" not in article:
+            return 0
+        text = article.get("text", "")
+        postings, terms = [], set()
+        for sent_idx, (pos_tags, sentiment, sent_range) in enumerate(article["sentence_info"]):
+            start, end = sent_range["start_char"], sent_range["end_char"]
+            for value in pos_tags["ENT"]:
+                entity = normalise_entity(value)
+                if not entity:
+                    continue
+                found = text.find(value, start, end)
+                span = (found, found + len(value)) if found >= 0 else (start, end)
+                postings.append(
+                    (entity, article["id"], sent_idx, *span, sentiment["sentiment"]["label"], sentiment["sentiment"]["score"])
+                )
+                terms.update((term, entity) for term in entity.split(" "))
+        self.conn.executemany("INSERT INTO mentions VALUES (?,?,?,?,?,?,?)", postings)
+        self.conn.executemany("INSERT OR IGNORE INTO terms VALUES (?,?)", terms)
+        self.conn.execute("INSERT INTO indexed_articles VALUES (?)", (article["id"],))
+        return len(postings)
+
+    def update(self, articles: Iterable[dict], commit_every: int = 1000) -> int:
+        """Indexes the articles that are not indexed yet, returns how many were added."""
+        added = 0
+        for article in articles:
+            if self.add_article(article):
+                added += 1
+                if added % commit_every == 0:
+                    self.commit()
+        self.commit()
+        logger.info(f"indexed mentions of {added} new articles")
+        return added
+
+    def entities(self, query: str) -> List[str]:
+        entity = normalise_entity(query)
+        rows = self.conn.execute("SELECT entity FROM terms WHERE term = ?", (entity,)).fetchall()
+        return sorted({entity} | {row[0] for row in rows})
+
+    def search(self, query: str, cursor: int = 0, limit: int = 50) -> dict:
+        """
+        Mentions of query, paginated by a cursor: pass the returned next_cursor to get the next page,
+        which is None on the last page.
+        """
+        entities = self.entities(query)
+        placeholders = ",".join("?" * len(entities))
+        rows = self.conn.execute(
+            f"""
+            SELECT rowid, entity, article_id, sent_idx, start_char, end_char, label, score FROM mentions
+            WHERE entity IN ({placeholders}) AND rowid > ? ORDER BY rowid LIMIT ?
+            """,
+            (*entities, cursor, limit + 1),
+        ).fetchall()
+        results = [
+            {
+                "entity": entity,
+                "article_id": article_id,
+                "sent_idx": sent_idx,
+                "start_char": start_char,
+                "end_char": end_char,
+                "sentiment": {"label": label, "score": score},
+            }
+            for _, entity, article_id, sent_idx, start_char, end_char, label, score in rows[:limit]
+        ]
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return {"results": results, "next_cursor": next_cursor}
+
+
+# trailing words dropped from team names, so "Norwich" in a report counts for "Norwich City"
+TEAM_SUFFIXES = ("city", "united", "town", "athletic", "albion", "rovers", "wanderers", "hotspur", "county", "fc", "afc")
+# sqlite expressions turning a yyyy-mm-dd day into the bucket of a granularity
+GRANULARITIES = {
+    "day": "day",
+    "week": "strftime('%Y-W%W', day)",
+    "month": "substr(day, 1, 7)",
+    "year": "substr(day, 1, 4)",
+}
+
+
+def team_aliases(team: str) -> List[str]:
+    name = normalise_entity(team)
+    words = name.split(" ")
+    if len(words) > 1 and words[-1] in TEAM_SUFFIXES:
+        return [name, " ".join(words[:-1])]
+    return [name]
+
+
+class SentimentAggregates:
+    """
+    Sentence sentiment per entity and per team, summed into daily buckets by match_date, backed by sqlite.
+
+    A bucket holds the sum of signed scores (negative for NEGATIVE labels), the number of sentences and
+    the positive and negative counts, so a series over any range and granularity costs O(buckets).
+    Sentences count for a team when one of their entities is the team name, with or without its suffix.
+    """
+
+    def __init__(self, filename: str = "data/aggregates.db"):
+        self.conn = data_utils.connect(filename, check_same_thread=False)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS buckets (
+                kind text, key text, day text, score_sum real, n integer, n_pos integer, n_neg integer,
+                PRIMARY KEY (kind, key, day)
+            );
+            CREATE TABLE IF NOT EXISTS aggregated_articles (article_id text PRIMARY KEY);
+            """
+        )
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def commit(self):
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM aggregated_articles").fetchone()[0]
+
+    def __contains__(self, article_id: str):
+        return self.conn.execute("SELECT 1 FROM aggregated_articles WHERE article_id = ?", (article_id,)).fetchone() is not None
+
+    def add_article(self, article: dict) -> int:
+        """Adds the sentences of a tagged article to their buckets, unless it is already added. Call commit to persist."""
+        if article["id"] in self or "sentence_info" not in article:
+            return 0
+        day = article.get("match_date")
+        deltas: Dict[Tuple[str, str], List[float]] = {}
+        if day:
+            teams = {
+                alias: normalise_entity(team)
+                for team in (article.get("home_team"), article.get("away_team"))
+                if team
+                for alias in team_aliases(team)
+            }
+            for pos_tags, sentiment, _ in article["sentence_info"]:
+                positive = sentiment["sentiment"]["label"] == "POSITIVE"
+                score = sentiment["sentiment"]["score"] if positive else -sentiment["sentiment"]["score"]
+                entities = {normalise_entity(value) for value in pos_tags["ENT"]} - {""}
+                keys = {("entity", entity) for entity in entities} | {
+                    ("team", teams[entity]) for entity in entities if entity in teams
+                }
+                for key in keys:
+                    delta = deltas.setdefault(key, [0.0, 0, 0, 0])
+                    delta[0] += score
+                    delta[1] += 1
+                    delta[2] += positive
+                    delta[3] += not positive
+        self.conn.executemany(
+            """
+            INSERT INTO buckets VALUES (?,?,?,?,?,?,?) ON CONFLICT (kind, key, day) DO UPDATE SET
+            score_sum = score_sum + excluded.score_sum, n = n + excluded.n,
+            n_pos = n_pos + excluded.n_pos, n_neg = n_neg + excluded.n_neg
+            """,
+            ((kind, key, day, *delta) for (kind, key), delta in deltas.items()),
+        )
+        self.conn.execute("INSERT INTO aggregated_articles VALUES (?)", (article["id"],))
+        return len(deltas)
+
+    def update(self, articles: Iterable[dict], commit_every: int = 1000) -> int:
+        """Adds the articles that are not added yet, returns how many were added."""
+        added = 0
+        for article in articles:
+            if self.add_article(article):
+                added += 1
+                if added % commit_every == 0:
+                    self.commit()
+        self.commit()
+        logger.info(f"aggregated sentiment of {added} new articles")
+        return added
+
+    def series(self, kind: str, keys: List[str], start: str = None, end: str = None, granularity: str = "month") -> List[dict]:
+        """
+        Sentiment per bucket of keys taken together, e.g. every entity matching a player, between the
+        start and end days (yyyy-mm-dd, both included).
+        """
+        bucket = GRANULARITIES[granularity]
+        placeholders = ",".join("?" * len(keys))
+        rows = self.conn.execute(
+            f"""
+            SELECT {bucket} AS bucket, SUM(score_sum), SUM(n), SUM(n_pos), SUM(n_neg) FROM buckets
+            WHERE kind = ? AND key IN ({placeholders}) AND day >= ? AND day <= ?
+            GROUP BY bucket ORDER BY bucket
+            """,
+            (kind, *keys, start or "0000-00-00", end or "9999-99-99"),
+        ).fetchall()
+        return [
+            {"bucket": bucket, "mean_score": score_sum / n, "count": n, "positive": n_pos, "negative": n_neg}
+            for bucket, score_sum, n, n_pos, n_neg in rows
+        ]
+
+
+class MatchCatalogue:
+    """
+    Matches by home team, away team and match date, and team rosters, backed by sqlite.
+
+    Rosters are derived from entity_labels PERSON: a player appears for both teams of every match
+    whose report names them, and co-occurs with a team when both are ENTs of the same sentence. A
+    player belongs to the team they appear and co-occur with the most, e.g. their own team rather
+    than the opponents they met once.
+    """
+
+    def __init__(self, filename: str = "data/matches.db"):
+        self.conn = data_utils.connect(filename, check_same_thread=False)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS matches (
+                article_id text PRIMARY KEY, home_key text, away_key text, home_team text, away_team text,
+                match_date text, headline text, link text, stadium text, players text
+            );
+            CREATE INDEX IF NOT EXISTS matches_home ON matches (home_key, match_date);
+            CREATE INDEX IF NOT EXISTS matches_away ON matches (away_key, match_date);
+            CREATE INDEX IF NOT EXISTS matches_date ON matches (match_date);
+            CREATE TABLE IF NOT EXISTS teams (alias text, team_key text, team text, UNIQUE (alias, team_key));
+            CREATE TABLE IF NOT EXISTS rosters (
+                team_key text, player_key text, player text, appearances integer, co_mentions integer,
+                PRIMARY KEY (team_key, player_key)
+            );
+            CREATE INDEX IF NOT EXISTS rosters_player ON rosters (player_key);
+            """
+        )
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def commit(self):
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+
+    def __contains__(self, article_id: str):
+        return self.conn.execute("SELECT 1 FROM matches WHERE article_id = ?", (article_id,)).fetchone() is not None
+
+    def add_article(self, article: dict) -> int:
+        """Adds the match of a tagged article and its players to the rosters, unless it is already added. Call commit to persist."""
+        if article["id"] in self or "entity_labels" not in article:
+            return 0
+        teams = {normalise_entity(team): team for team in (article.get("home_team"), article.get("away_team")) if team}
+        players: Dict[str, str] = {}
+        for person in article["entity_labels"]["PERSON"]:
+            players.setdefault(normalise_entity(person), person)
+        players.pop("", None)
+        aliases = {alias: team_key for team_key in teams for alias in team_aliases(team_key)}
+        co_mentions: Dict[Tuple[str, str], int] = {}
+        for pos_tags, _, _ in article.get("sentence_info", []):
+            entities = {normalise_entity(value) for value in pos_tags["ENT"]}
+            for team_key in {aliases[entity] for entity in entities if entity in aliases}:
+                for player_key in entities & players.keys():
+                    co_mentions[(team_key, player_key)] = co_mentions.get((team_key, player_key), 0) + 1
+
+        home_key, away_key = normalise_entity(article.get("home_team") or ""), normalise_entity(article.get("away_team") or "")
+        self.conn.execute(
+            "INSERT INTO matches VALUES (?,?,?,?,?,?,?,?,?,?)",
+            (
+                article["id"],
+                home_key,
+                away_key,
+                article.get("home_team"),
+                article.get("away_team"),
+                article.get("match_date"),
+                article.get("headline"),
+                article.get("link"),
+                article.get("stadium"),
+                json.dumps(sorted(players.values())),
+            ),
+        )
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO teams VALUES (?,?,?)", ((alias, team_key, teams[team_key]) for alias, team_key in aliases.items())
+        )
+        self.conn.executemany(
+            """
+            INSERT INTO rosters VALUES (?,?,?,1,?) ON CONFLICT (team_key, player_key) DO UPDATE SET
+            appearances = appearances + 1, co_mentions = co_mentions + excluded.co_mentions
+            """,
+            (
+                (team_key, player_key, player, co_mentions.get((team_key, player_key), 0))
+                for team_key in teams
+                for player_key, player in players.items()
+            ),
+        )
+        return 1
+
+    def update(self, articles: Iterable[dict], commit_every: int = 1000) -> int:
+        """Adds the articles that are not added yet, returns how many were added."""
+        added = 0
+        for article in articles:
+            if self.add_article(article):
+                added += 1
+                if added % commit_every == 0:
+                    self.commit()
+        self.commit()
+        logger.info(f"catalogued {added} new matches")
+        return added
+
+    def team_keys(self, team: str) -> List[str]:
+        """Teams a name refers to, e.g. "Norwich" and "norwich city" both give "norwich city"."""
+        rows = self.conn.execute("SELECT DISTINCT team_key FROM teams WHERE alias = ?", (normalise_entity(team),)).fetchall()
+        return [row[0] for row in rows]
+
+    def roster(self, team: str, limit: int = 50) -> List[dict]:
+        """Players of a team, most mentioned first."""
+        team_keys = self.team_keys(team)
+        if not team_keys:
+            return []
+        placeholders = ",".join("?" * len(team_keys))
+        rows = self.conn.execute(
+            f"""
+            SELECT player, appearances, co_mentions FROM rosters r
+            WHERE team_key IN ({placeholders})
+            AND appearances + co_mentions >= (SELECT MAX(appearances + co_mentions) FROM rosters WHERE player_key = r.player_key)
+            ORDER BY appearances + co_mentions DESC, player LIMIT ?
+            """,
+            (*team_keys, limit),
+        ).fetchall()
+        return [
+            {"player": player, "appearances": appearances, "co_mentions": co_mentions} for player, appearances, co_mentions in rows
+        ]
+
+    def article_ids(self, team: str = None, start: str = None, end: str = None) -> List[str]:
+        """Ids of the reports of a team's matches between the start and end days (yyyy-mm-dd, both included)."""
+        clauses, params = ["match_date >= ?", "match_date <= ?"], [start or "0000-00-00", end or "9999-99-99"]
+        if team is not None:
+            team_keys = self.team_keys(team) or [normalise_entity(team)]
+            placeholders = ",".join("?" * len(team_keys))
+            clauses.append(f"(home_key IN ({placeholders}) OR away_key IN ({placeholders}))")
+            params.extend(team_keys * 2)
+        rows = self.conn.execute(f"SELECT article_id FROM matches WHERE {' AND '.join(clauses)}", params)
+        return [row[0] for row in rows]
+
+    def matches(
+        self, team: str = None, home_team: str = None, away_team: str = None, match_date: str = None, limit: int = 50
+    ) -> List[dict]:
+        """Matches filtered by any of team (home or away), home team, away team and match date (yyyy-mm-dd), latest first."""
+        clauses, params = [], []
+        for column, name in (("home_key", home_team), ("away_key", away_team)):
+            if name is not None:
+                team_keys = self.team_keys(name) or [normalise_entity(name)]
+                clauses.append(f"{column} IN ({','.join('?' * len(team_keys))})")
+                params.extend(team_keys)
+        if team is not None:
+            team_keys = self.team_keys(team) or [normalise_entity(team)]
+            placeholders = ",".join("?" * len(team_keys))
+            clauses.append(f"(home_key IN ({placeholders}) OR away_key IN ({placeholders}))")
+            params.extend(team_keys * 2)
+        if match_date is not None:
+            clauses.append("match_date = ?")
+            params.append(match_date)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.conn.execute(
+            f"""
+            SELECT article_id, home_team, away_team, match_date, headline, link, stadium, players FROM matches
+            {where} ORDER BY match_date DESC LIMIT ?
+            """,
+            (*params, limit),
+        ).fetchall()
+        return [
+            {
+                "article_id": article_id,
+                "home_team": home_team,
+                "away_team": away_team,
+                "match_date": match_date,
+                "headline": headline,
+                "link": link,
+                "stadium": stadium,
+                "players": json.loads(players),
+            }
+            for article_id, home_team, away_team, match_date, headline, link, stadium, players in rows
+        ]
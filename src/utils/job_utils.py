@@ -0,0 +1,99 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Tuple
+
+from utils import utils
+
+logger = utils.get_logger(f"{__name__}.log")
+
+
+class Job:
+    """A background job that reports its own progress, e.g. articles tagged out of the pending ones."""
+
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = "queued"
+        self.total = None
+        self.done = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    def set_total(self, total: int):
+        self.total = total
+
+    def advance(self, n: int = 1):
+        self.done += n
+
+    def report(self) -> dict:
+        end = self.finished_at or time.time()
+        secs = end - self.started_at if self.started_at else 0.0
+        rate = self.done / secs if secs > 0 else 0.0
+        eta = (self.total - self.done) / rate if self.total is not None and rate > 0 and self.active else None
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "secs": round(secs, 3),
+            "per_sec": round(rate, 3),
+            "eta_secs": round(eta, 1) if eta is not None else None,
+            "error": self.error,
+        }
+
+
+class JobRunner:
+    """
+    Runs jobs on dedicated worker threads, away from the event loop. Submitting a job while one with
+    the same name is still queued or running returns the running one instead of starting a duplicate.
+    """
+
+    def __init__(self, max_workers: int = 1, max_history: int = 100):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.max_history = max_history
+        self._lock = threading.Lock()
+
+    def submit(self, name: str, fn: Callable[[Job], None]) -> Tuple[Job, bool]:
+        """Starts fn(job) in the background, returns the job and whether it was newly created."""
+        with self._lock:
+            for job in self.jobs.values():
+                if job.name == name and job.active:
+                    return job, False
+            job = Job(name)
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_history:
+                oldest = next(iter(self.jobs.values()))
+                if oldest.active:
+                    break
+                self.jobs.popitem(last=False)
+        self.executor.submit(self._run, job, fn)
+        return job, True
+
+    def _run(self, job: Job, fn: Callable[[Job], None]):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            fn(job)
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = repr(e)
+            logger.info(f"job {job.name} {job.id} failed: {traceback.format_exc()}")
+        finally:
+            job.finished_at = time.time()
+        logger.info(f"job {job.name} {job.id}: {job.report()}")
+
+    def get(self, job_id: str) -> Job:
+        return self.jobs.get(job_id)
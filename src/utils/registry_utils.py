@@ -0,0 +1,60 @@
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from utils import utils
+
+logger = utils.get_logger(f"{__name__}.log")
+
+
+class ModelRegistry:
+    """
+    Named, lazily loaded heavyweight components, e.g. the tagger and the tagged dataset. A component
+    is loaded once and kept until reload is called explicitly. Reloading builds the new instance
+    while the old one keeps serving, then swaps them and bumps the component's version.
+
+    params:
+    - loaders: component name to a function building it, the result should have a load_times dict. It is
+      called with reload=True by reload, e.g. to fetch new data instead of trusting a recent sync
+    """
+
+    def __init__(self, loaders: Dict[str, Callable[..., Any]]):
+        self.loaders = loaders
+        self.instances: Dict[str, Any] = {}
+        self.versions: Dict[str, int] = {name: 0 for name in loaders}
+        self.status: Dict[str, dict] = {name: {"ready": False} for name in loaders}
+        self._locks = {name: threading.Lock() for name in loaders}
+
+    def ready(self, name: str) -> bool:
+        return name in self.instances
+
+    def get(self, name: str):
+        """The loaded component, loading it first if it never was."""
+        instance = self.instances.get(name)
+        if instance is not None:
+            return instance
+        with self._locks[name]:
+            # loaded by another thread while this one waited for the lock
+            if name not in self.instances:
+                self._load(name, reload=False)
+        return self.instances[name]
+
+    def reload(self, name: str):
+        """Loads the component again and swaps it in, the current one keeps serving until then."""
+        with self._locks[name]:
+            self._load(name, reload=True)
+        return self.instances[name]
+
+    def _load(self, name: str, reload: bool):
+        ts = time.time()
+        try:
+            instance = self.loaders[name](reload=reload)
+        except Exception as e:
+            # a failed reload keeps serving the previous instance
+            self.status[name] = {"ready": self.ready(name), "load_secs": time.time() - ts, "error": repr(e)}
+            logger.info(f"failed to load {name}: {e}")
+            raise
+        self.instances[name] = instance
+        self.versions[name] += 1
+        self.status[name] = {"ready": True, "load_secs": time.time() - ts, "load_times": getattr(instance, "load_times", {})}
+        logger.info(f"loaded {name} version {self.versions[name]} in {time.time() - ts:.1f}s")
@@ -0,0 +1,324 @@
+"""Compact, read optimised in memory copy of the tagged articles in articles.jl.
+
+Instead of a dict of python strings and lists per article, the store keeps flat array columns:
+- strings that repeat (teams, dates, entities, pos words, labels) are interned into one vocabulary of int ids
+- sentences, their pos tag lists and the PERSON labels are ragged columns, a pointer array into a flat id array
+- article texts and the fields without a column of their own live in append only blob files, read through
+  a memory map by byte offsets, so they stay on disk until asked for
+A rebuild writes new blob files of the next generation instead of truncating the current ones, which another
+instance, e.g. the one serving while a new one loads, may still have mapped.
+The columns are saved next to the blobs, a restart loads them with one read per column and then only
+parses the lines appended to articles.jl since.
+"""
+import json
+import mmap
+import threading
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List
+
+from utils import data_utils, utils
+
+logger = utils.get_logger(f"{__name__}.log")
+
+# article fields with a column of their own, every other field goes into the extra blob
+META_FIELDS = ["scrape_date", "link", "headline", "home_team", "away_team", "match_date", "author", "stadium"]
+# (name, array typecode) of every column, ptr columns hold one more item than the rows they index
+COLUMNS = [
+    ("line_start", "q"),
+    ("text_start", "q"),
+    ("text_end", "q"),
+    ("extra_start", "q"),
+    ("extra_end", "q"),
+    ("flags", "b"),
+    ("meta", "i"),
+    ("person_ptr", "q"),
+    ("person_ids", "i"),
+    ("sent_ptr", "q"),
+    ("sent_start", "i"),
+    ("sent_end", "i"),
+    ("sent_label", "i"),
+    ("sent_score", "d"),
+    ("seg_ptr", "q"),
+    ("seg_key", "i"),
+    ("word_ptr", "q"),
+    ("word_ids", "i"),
+]
+HAS_TEXT, HAS_LABELS, HAS_SENTENCES = 1, 2, 4
+# meta ids of a missing field
+MISSING = -1
+
+
+class Vocab:
+    """Interned strings, each stored once and referred to by its int id."""
+
+    def __init__(self, strings: List[str] = None):
+        self.strings: List[str] = []
+        self.ids: Dict[str, int] = {}
+        for string in strings or []:
+            self.add(string)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def add(self, string: str) -> int:
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    def __getitem__(self, string_id: int) -> str:
+        return self.strings[string_id]
+
+
+class Blob:
+    """Append only file of utf-8 strings, read back through a memory map by byte offsets."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.touch()
+        # the handle keeps the file readable after a rebuild unlinks it
+        self.size = self.path.stat().st_size
+        self._file = open(self.path, "rb")
+        self._map = None
+        # readers run on several threads, one of them remapping must not close the map under another
+        self._lock = threading.Lock()
+
+    def append(self, data: str):
+        encoded = data.encode("utf-8")
+        with open(self.path, "ab") as blob_file:
+            start = blob_file.tell()
+            blob_file.write(encoded)
+        self.size = start + len(encoded)
+        return start, self.size
+
+    def read(self, start: int, end: int) -> str:
+        with self._lock:
+            if self._map is None or end > len(self._map):
+                # appends after mapping are not visible, map the file again, the old map is left to the gc
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            blob_map = self._map
+        return blob_map[start:end].decode("utf-8")
+
+    def truncate(self, size: int = 0):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        with open(self.path, "r+b") as blob_file:
+            blob_file.truncate(size)
+        self.size = size
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+class ArticleStore:
+    """
+    Compact copy of an append only jsonl file of tagged articles, see the module docstring.
+
+    params:
+    - path: the jsonl file, e.g. data/tagged/articles.jl
+    - folder: where the columns, vocabulary and blobs are kept
+    """
+
+    def __init__(self, path: Path, folder: Path = Path("data/store")):
+        self.path = path
+        self.folder = folder
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.generation = 0
+        self.texts = self.extras = None
+        self.load()
+
+    def open_blobs(self):
+        self.close()
+        self.texts = Blob(self.folder / f"texts-{self.generation}.blob")
+        self.extras = Blob(self.folder / f"extras-{self.generation}.blob")
+
+    def reset(self):
+        # new files, the current ones stay intact for anyone still reading them until save removes them
+        self.generation += 1
+        self.open_blobs()
+        self.vocab = Vocab()
+        self.article_ids: List[str] = []
+        self.by_id: Dict[str, int] = {}
+        self.columns: Dict[str, array] = {name: array(typecode) for name, typecode in COLUMNS}
+        for name in ("person_ptr", "sent_ptr", "seg_ptr", "word_ptr"):
+            self.columns[name].append(0)
+        self.scanned = {"offset": 0, "last_id": None, "last_offset": None}
+        # left over by a rebuild that never saved
+        self.texts.truncate()
+        self.extras.truncate()
+
+    def load(self):
+        meta_path = self.folder / "meta.json"
+        meta = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+        if "generation" not in meta:
+            # a new store, or one written before blobs had generations
+            self.generation = 0
+            self.reset()
+            return
+        self.generation = meta["generation"]
+        self.open_blobs()
+        self.vocab = Vocab(meta["vocab"])
+        self.article_ids = meta["article_ids"]
+        self.by_id = {article_id: i for i, article_id in enumerate(self.article_ids)}
+        self.scanned = meta["scanned"]
+        self.columns = {}
+        for name, typecode in COLUMNS:
+            column = array(typecode)
+            column.frombytes((self.folder / f"{name}.bin").read_bytes())
+            self.columns[name] = column
+        # blob writes that were not followed by a save are dropped, the lines are parsed again
+        self.texts.truncate(self.columns["text_end"][-1] if self.article_ids else 0)
+        self.extras.truncate(self.columns["extra_end"][-1] if self.article_ids else 0)
+
+    def save(self):
+        for name, _ in COLUMNS:
+            with data_utils.atomic_open(self.folder / f"{name}.bin", "wb") as column_file:
+                self.columns[name].tofile(column_file)
+        meta = {"vocab": self.vocab.strings, "article_ids": self.article_ids, "scanned": self.scanned, "generation": self.generation}
+        # meta goes last, so it never points past the columns it describes
+        with data_utils.atomic_open(self.folder / "meta.json") as meta_file:
+            json.dump(meta, meta_file)
+        # blobs of earlier generations are no longer referenced, open handles keep them readable until closed
+        for blob_path in self.folder.glob("*.blob"):
+            if blob_path not in (self.texts.path, self.extras.path):
+                blob_path.unlink()
+
+    def __len__(self):
+        return len(self.article_ids)
+
+    def __contains__(self, article_id: str):
+        return article_id in self.by_id
+
+    def nbytes(self) -> int:
+        """Bytes held by the columns, texts and extras stay on disk."""
+        return sum(column.itemsize * len(column) for column in self.columns.values())
+
+    def refresh(self) -> int:
+        """Adds the lines appended to path since the last refresh, or all of them if the file was replaced."""
+        if not self.path.exists():
+            return 0
+        offset, last_id, last_offset = self.scanned["offset"], self.scanned["last_id"], self.scanned["last_offset"]
+        if offset > self.path.stat().st_size or (last_id is not None and not self._starts_with(last_offset, last_id)):
+            logger.info(f"{str(self.path)} was replaced, rebuilding the article store")
+            self.reset()
+            offset = 0
+        added = 0
+        for line_start, next_offset, article in data_utils.read_jsonl_at(self.path, offset):
+            self.add(article, line_start)
+            self.scanned = {"offset": next_offset, "last_id": article["id"], "last_offset": line_start}
+            added += 1
+        if added:
+            self.save()
+            logger.info(f"stored {added} articles, {len(self)} in total in {self.nbytes() / 2 ** 20:.1f} MiB")
+        return added
+
+    def _starts_with(self, offset: int, article_id: str) -> bool:
+        try:
+            return next(data_utils.read_jsonl_offsets(self.path, [offset]))[2].get("id") == article_id
+        except (StopIteration, ValueError):
+            return False
+
+    def add(self, article: dict, line_start: int):
+        columns, vocab = self.columns, self.vocab
+        i = len(self.article_ids)
+        if article["id"] in self.by_id:
+            # a later copy of the same article wins, like a dict keyed by id
+            logger.info(f"article {article['id']} is stored twice, keeping the last one")
+        self.article_ids.append(article["id"])
+        self.by_id[article["id"]] = i
+        columns["line_start"].append(line_start)
+
+        flags = 0
+        start, end = self.texts.size, self.texts.size
+        if "text" in article:
+            flags |= HAS_TEXT
+            start, end = self.texts.append(article["text"])
+        columns["text_start"].append(start)
+        columns["text_end"].append(end)
+        extra = {
+            key: value for key, value in article.items() if key not in ("id", "text", "entity_labels", "sentence_info", *META_FIELDS)
+        }
+        start, end = self.extras.append(json.dumps(extra)) if extra else (self.extras.size, self.extras.size)
+        columns["extra_start"].append(start)
+        columns["extra_end"].append(end)
+        columns["meta"].extend(vocab.add(article[field]) if article.get(field) is not None else MISSING for field in META_FIELDS)
+
+        if "entity_labels" in article:
+            flags |= HAS_LABELS
+            columns["person_ids"].extend(vocab.add(person) for person in article["entity_labels"]["PERSON"])
+        columns["person_ptr"].append(len(columns["person_ids"]))
+
+        if "sentence_info" in article:
+            flags |= HAS_SENTENCES
+            for pos_tags, sentiment, sent_range in article["sentence_info"]:
+                columns["sent_start"].append(sent_range["start_char"])
+                columns["sent_end"].append(sent_range["end_char"])
+                columns["sent_label"].append(vocab.add(sentiment["sentiment"]["label"]))
+                columns["sent_score"].append(sentiment["sentiment"]["score"])
+                for key, words in pos_tags.items():
+                    columns["seg_key"].append(vocab.add(key))
+                    columns["word_ids"].extend(vocab.add(word) for word in words)
+                    columns["word_ptr"].append(len(columns["word_ids"]))
+                columns["seg_ptr"].append(len(columns["seg_key"]))
+        columns["sent_ptr"].append(len(columns["sent_start"]))
+        columns["flags"].append(flags)
+
+    def get(self, i: int) -> dict:
+        """The article stored at row i, as the dict it was read from."""
+        columns, vocab = self.columns, self.vocab
+        flags = columns["flags"][i]
+        article = {}
+        for field, string_id in zip(META_FIELDS, columns["meta"][i * len(META_FIELDS) : (i + 1) * len(META_FIELDS)]):
+            if string_id != MISSING:
+                article[field] = vocab[string_id]
+        if flags & HAS_TEXT:
+            article["text"] = self.texts.read(columns["text_start"][i], columns["text_end"][i])
+        if columns["extra_end"][i] > columns["extra_start"][i]:
+            article.update(json.loads(self.extras.read(columns["extra_start"][i], columns["extra_end"][i])))
+        article["id"] = self.article_ids[i]
+        if flags & HAS_LABELS:
+            person_ids = columns["person_ids"][columns["person_ptr"][i] : columns["person_ptr"][i + 1]]
+            article["entity_labels"] = {"PERSON": [vocab[person_id] for person_id in person_ids]}
+        if flags & HAS_SENTENCES:
+            sentence_info = []
+            for s in range(columns["sent_ptr"][i], columns["sent_ptr"][i + 1]):
+                pos_tags = {}
+                for seg in range(columns["seg_ptr"][s], columns["seg_ptr"][s + 1]):
+                    word_ids = columns["word_ids"][columns["word_ptr"][seg] : columns["word_ptr"][seg + 1]]
+                    pos_tags[vocab[columns["seg_key"][seg]]] = [vocab[word_id] for word_id in word_ids]
+                sentiment = {"sentiment": {"label": vocab[columns["sent_label"][s]], "score": columns["sent_score"][s]}}
+                sentence_info.append(
+                    [pos_tags, sentiment, {"start_char": columns["sent_start"][s], "end_char": columns["sent_end"][s]}]
+                )
+            article["sentence_info"] = sentence_info
+        return article
+
+    def rows(self, article_ids: Iterable[str] = None, after: int = 0) -> Iterator[int]:
+        """
+        Rows in file order, of the given articles or all of them, whose line starts at or after the
+        byte offset after. Only the last copy of an article stored twice is included.
+        """
+        line_start = self.columns["line_start"]
+        if article_ids is None:
+            candidates = range(bisect_left(line_start, after), len(self))
+        else:
+            candidates = sorted(self.by_id[article_id] for article_id in set(article_ids) if article_id in self.by_id)
+            candidates = [i for i in candidates if line_start[i] >= after]
+        for i in candidates:
+            if self.by_id[self.article_ids[i]] == i:
+                yield i
+
+    def next_offset(self, i: int) -> int:
+        """Byte offset in path right after the line of row i."""
+        return self.columns["line_start"][i + 1] if i + 1 < len(self) else self.scanned["offset"]
+
+    def close(self):
+        for blob in (self.texts, self.extras):
+            if blob is not None:
+                blob.close()
@@ -0,0 +1,154 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from settings import settings
+from utils import metrics_utils, utils
+
+logger = utils.get_logger(f"{__name__}.log")
+
+S3_BYTES = metrics_utils.registry.counter("s3_bytes_total", "Bytes transferred to and from s3", ["direction"])
+S3_FILES = metrics_utils.registry.counter("s3_files_total", "Files transferred to and from s3", ["direction", "outcome"])
+
+
+def get_s3_client(
+    max_pool_connections: int = settings.S3_MAX_POOL_CONNECTIONS,
+    max_retries: int = settings.S3_MAX_RETRIES,
+    endpoint_url: str = settings.S3_ENDPOINT_URL,
+):
+    """
+    S3 client with a connection pool large enough for the transfer threads, clients are thread safe
+    so one is shared by all of them.
+
+    params:
+    - max_pool_connections: size of the botocore connection pool
+    - max_retries: attempts per call with adaptive backoff, the only retry layer, callers don't retry again
+    - endpoint_url: e.g. a local S3 stand-in, defaults to AWS
+    """
+    # boto3 takes a noticeable part of a second to import, so only when a client is needed
+    import boto3
+    from botocore.config import Config
+
+    config = Config(max_pool_connections=max_pool_connections, retries={"max_attempts": max_retries, "mode": "adaptive"})
+    return boto3.client("s3", endpoint_url=endpoint_url, config=config)
+
+
+def transfer_config(
+    max_concurrency: int = settings.S3_MAX_CONCURRENCY,
+    part_size: int = settings.S3_MULTIPART_CHUNKSIZE,
+):
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=part_size,
+        max_concurrency=max_concurrency,
+        use_threads=True,
+    )
+
+
+class TransferProgress:
+    """Thread safe progress and throughput counter, usable as a boto3 transfer callback."""
+
+    def __init__(self, name: str, total_files: int, total_bytes: int = None, log_every: int = 50):
+        self.name = name
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.log_every = log_every
+        self.files = 0
+        self.bytes = 0
+        self.start = time.time()
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount: int):
+        with self._lock:
+            self.bytes += bytes_amount
+
+    def file_done(self):
+        with self._lock:
+            self.files += 1
+            files = self.files
+        if files % self.log_every == 0 or files == self.total_files:
+            logger.info(f"{self.name}: {self.report()}")
+
+    def report(self) -> dict:
+        secs = max(time.time() - self.start, 1e-9)
+        return {
+            "files": self.files,
+            "total_files": self.total_files,
+            "bytes": self.bytes,
+            "total_bytes": self.total_bytes,
+            "secs": round(secs, 3),
+            "files_per_sec": round(self.files / secs, 2),
+            "mb_per_sec": round(self.bytes / secs / 2 ** 20, 2),
+        }
+
+
+@utils.timeit
+def download_many(
+    keys: Dict[str, Path],
+    bucket: str,
+    s3_client,
+    max_workers: int = settings.S3_MAX_CONCURRENCY,
+    sizes: Dict[str, int] = None,
+) -> Tuple[List[str], List[Tuple[str, Exception]]]:
+    """
+    Downloads keys concurrently on a bounded thread pool sharing s3_client.
+
+    params:
+    - keys: s3 key to local path
+    - bucket: s3 bucket with target contents
+    - s3_client: initialized s3 client object, see get_s3_client
+    - max_workers: number of concurrent downloads
+    - sizes: optional s3 key to size in bytes, for progress reporting
+
+    returns: downloaded keys and (key, error) for keys that failed after the client's retries
+    """
+    total_bytes = sum(sizes.values()) if sizes is not None else None
+    progress = TransferProgress("download", total_files=len(keys), total_bytes=total_bytes)
+    # single object transfers are already parallel across keys, so don't nest a second pool per file
+    config = transfer_config(max_concurrency=1)
+
+    def download(foreign_key: str, local_key: Path):
+        local_key.parent.mkdir(parents=True, exist_ok=True)
+        s3_client.download_file(bucket, foreign_key, str(local_key), Callback=progress, Config=config)
+        progress.file_done()
+        return foreign_key
+
+    done, failed = [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(download, foreign_key, local_key): foreign_key for foreign_key, local_key in keys.items()}
+        for future in as_completed(futures):
+            try:
+                done.append(future.result())
+            except (BotoCoreError, ClientError, OSError) as e:
+                logger.info(f"failed to download {futures[future]} because of: {e}")
+                failed.append((futures[future], e))
+    S3_BYTES.inc(progress.bytes, direction="download")
+    S3_FILES.inc(len(done), direction="download", outcome="done")
+    S3_FILES.inc(len(failed), direction="download", outcome="failed")
+    logger.info(f"downloaded {len(done)} files, {len(failed)} failed: {progress.report()}")
+    return done, failed
+
+
+@utils.timeit
+def upload_file(
+    path: Path,
+    bucket: str,
+    key: str,
+    s3_client,
+    max_concurrency: int = settings.S3_MAX_CONCURRENCY,
+    part_size: int = settings.S3_MULTIPART_CHUNKSIZE,
+):
+    """Uploads a file, as concurrent multipart parts when it is larger than part_size."""
+    progress = TransferProgress(f"upload {key}", total_files=1, total_bytes=path.stat().st_size)
+    config = transfer_config(max_concurrency=max_concurrency, part_size=part_size)
+    response = s3_client.upload_file(str(path), bucket, key, Callback=progress, Config=config)
+    progress.file_done()
+    S3_BYTES.inc(progress.bytes, direction="upload")
+    S3_FILES.inc(direction="upload", outcome="done")
+    return response
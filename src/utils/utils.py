@@ -8,13 +8,16 @@ import shutil
 import sys
 import time
 import warnings
+from contextlib import contextmanager
+from functools import partial, wraps
+from itertools import islice
 from datetime import datetime, timedelta
 from typing import List
 
-import numpy as np
-import pandas as pd
 import pytz
 
+from utils import metrics_utils
+
 
 def remove_contents_of_dir(dir_path):
     """Removes contencts folder directory recursively.
@@ -82,17 +85,29 @@ def time_now(local_tz: pytz.timezone = None):
     return now
 
 
-def timeit(method):
+def timeit(method=None, name: str = None):
+    """Records the wall time of every call in the stage_seconds histogram, see metrics_utils.
+    Args:
+        method (Callable): The function to time, when used as @timeit.
+        name (str): Stage label, defaults to the function name, when used as @timeit(name=...).
+    Returns:
+        Callable: The timed function, a log_time dict keyword also gets the ms under log_name.
+    """
+    if method is None:
+        return partial(timeit, name=name)
+    stage = name or method.__name__
+
+    @wraps(method)
     def timed(*args, **kw):
-        ts = time.time()
-        result = method(*args, **kw)
-        te = time.time()
-        if "log_time" in kw:
-            name = kw.get("log_name", method.__name__.upper())
-            kw["log_time"][name] = int((te - ts) * 1000)
-        else:
-            print("%r  %2.2f ms" % (method.__name__, (te - ts) * 1000))
-        return result
+        ts = time.perf_counter()
+        try:
+            return method(*args, **kw)
+        finally:
+            secs = time.perf_counter() - ts
+            metrics_utils.STAGE_SECONDS.observe(secs, stage=stage)
+            if "log_time" in kw:
+                log_name = kw.get("log_name", method.__name__.upper())
+                kw["log_time"][log_name] = int(secs * 1000)
 
     return timed
 
@@ -109,3 +124,52 @@ def join_lsts_dct(*args: List[dict]):
     assert len(set(lens)) == 1, "lists are not same length"
     lst = list(zip(*args))
     return lst
+
+
+def length_batches(lengths: List[int], batch_size: int, max_tokens: int = None):
+    """Groups indices into length sorted batches.
+    Args:
+        lengths (List[int]): Length of each item, e.g. number of tokens.
+        batch_size (int): Maximum number of items in a batch.
+        max_tokens (int): Maximum padded size (items * longest item) of a batch.
+    Returns:
+        List[List[int]]: Batches of indices into lengths.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    for i in order:
+        full = len(batch) == batch_size
+        too_long = max_tokens is not None and lengths[i] * (len(batch) + 1) > max_tokens
+        if batch and (full or too_long):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def chunks(iterable, size: int):
+    """Lazily splits an iterable into lists of at most size items.
+    Args:
+        iterable (Iterable): Items to split, e.g. a generator.
+        size (int): Maximum number of items per chunk.
+    Yields:
+        list: The next chunk.
+    """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+@contextmanager
+def timer(log_time: dict, name: str):
+    """Records the wall time of the block in log_time[name], in ms like timeit."""
+    ts = time.time()
+    try:
+        yield
+    finally:
+        log_time[name] = int((time.time() - ts) * 1000)
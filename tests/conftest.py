@@ -0,0 +1,69 @@
+import json
+from pathlib import Path
+
+import pytest
+from moto import mock_aws
+
+from models.soccer_text_model import SoccerArticles
+from utils import index_utils, store_utils, transfer_utils
+
+BUCKET = "guardian-match-reports-test"
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    # moto intercepts every call, the credentials only need to exist
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = transfer_utils.get_s3_client(endpoint_url=None)
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def tagged_article(
+    article_id: str,
+    home_team: str = "Norwich City",
+    away_team: str = "Watford",
+    match_date: str = "2021-03-06",
+    sentences=((["Norwich", "Pukki"], "POSITIVE", 0.75),),
+    persons=("Pukki",),
+) -> dict:
+    """A tagged article, with a sentence of its (ENTs, sentiment label, score) each."""
+    text = " ".join(f"{' and '.join(ents)} played." for ents, _, _ in sentences)
+    sentence_info, start = [], 0
+    for ents, label, score in sentences:
+        end = start + len(f"{' and '.join(ents)} played.")
+        sentence_info.append(
+            [{"ENT": list(ents)}, {"sentiment": {"label": label, "score": score}}, {"start_char": start, "end_char": end}]
+        )
+        start = end + 1
+    return {
+        "id": article_id,
+        "home_team": home_team,
+        "away_team": away_team,
+        "match_date": match_date,
+        "headline": f"{home_team} v {away_team}",
+        "text": text,
+        "entity_labels": {"PERSON": list(persons)},
+        "sentence_info": sentence_info,
+    }
+
+
+def build_soccer_articles(folder: Path, articles) -> SoccerArticles:
+    """SoccerArticles over the given articles, stored and indexed in folder, without syncing from s3."""
+    folder.mkdir(parents=True, exist_ok=True)
+    with open(folder / "articles.jl", "w") as articles_file:
+        for article in articles:
+            articles_file.write(json.dumps(article) + "\n")
+    soccer_articles = SoccerArticles.__new__(SoccerArticles)
+    soccer_articles.load_times = {}
+    soccer_articles.data_path = folder / "articles.jl"
+    soccer_articles.store = store_utils.ArticleStore(folder / "articles.jl", folder / "store")
+    soccer_articles.store.refresh()
+    soccer_articles.mentions = index_utils.MentionIndex(str(folder / "mentions.db"))
+    soccer_articles.aggregates = index_utils.SentimentAggregates(str(folder / "aggregates.db"))
+    soccer_articles.matches = index_utils.MatchCatalogue(str(folder / "matches.db"))
+    soccer_articles.update_indexes()
+    return soccer_articles
@@ -0,0 +1,119 @@
+import queue
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from conftest import build_soccer_articles, tagged_article
+from utils import cache_utils, index_utils
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # components are swapped for fakes, nothing is loaded
+    monkeypatch.setattr(app.models, "instances", {})
+    monkeypatch.setattr(app.models, "versions", {name: 0 for name in app.models.loaders})
+    monkeypatch.setattr(app, "responses", cache_utils.ResponseCache(max_bytes=1024 * 1024, ttl=60))
+    return TestClient(app.app)
+
+
+def loaded(name: str, instance):
+    app.models.instances[name] = instance
+    app.models.versions[name] += 1
+
+
+def test_tag_answers_503_when_the_batcher_queue_is_full(client, monkeypatch):
+    loaded("tagger", object())
+
+    def full(item):
+        raise queue.Full
+
+    monkeypatch.setattr(app.tag_batcher, "submit", full)
+
+    assert client.post("/tag", json={"text": "Wolves won."}).status_code == 503
+
+
+def test_tag_answers_503_while_the_tagger_loads(client, monkeypatch):
+    monkeypatch.setattr(app.jobs, "submit", lambda name, fn: (None, False))
+
+    assert client.post("/tag", json={"text": "Wolves won."}).status_code == 503
+
+
+def test_matches_filters_the_catalogue(client, tmp_path):
+    loaded("articles", build_soccer_articles(tmp_path, [tagged_article("a"), tagged_article("b", match_date="2021-03-13")]))
+
+    response = client.get("/matches", params={"team": "Norwich", "match_date": "2021-03-13"})
+
+    assert response.status_code == 200
+    assert [(match["article_id"], match["home_team"], match["players"]) for match in response.json()] == [
+        ("b", "Norwich City", ["Pukki"])
+    ]
+
+
+def test_query_pages_through_matching_articles(client, tmp_path):
+    loaded("articles", build_soccer_articles(tmp_path, [tagged_article("a"), tagged_article("b"), tagged_article("c")]))
+    expression = "entity_labels.PERSON[0]"
+
+    first = client.get("/query", params={"expression": expression, "limit": 2}).json()
+    last = client.get("/query", params={"expression": expression, "limit": 2, "cursor": first["next_cursor"]}).json()
+
+    assert [result["article_id"] for result in first["results"]] == ["a", "b"]
+    assert last == {"results": [{"article_id": "c", "value": "Pukki"}], "next_cursor": None}
+
+
+def test_query_answers_400_on_an_invalid_expression(client, tmp_path):
+    loaded("articles", build_soccer_articles(tmp_path, [tagged_article("a")]))
+
+    assert client.get("/query", params={"expression": "[?"}).status_code == 400
+
+
+def test_player_mentions_answers_304_to_an_unchanged_etag(client, tmp_path):
+    loaded("articles", build_soccer_articles(tmp_path, [tagged_article("a")]))
+
+    first = client.get("/player_mentions", params={"player": "Pukki"})
+    again = client.get("/player_mentions", params={"player": "pukki"}, headers={"If-None-Match": first.headers["ETag"]})
+
+    assert first.status_code == 200
+    assert [mention["article_id"] for mention in first.json()["results"]] == ["a"]
+    assert again.status_code == 304
+    assert again.headers["ETag"] == first.headers["ETag"]
+    assert again.content == b""
+
+
+def test_cached_responses_are_rendered_again_after_an_index_commit(client, tmp_path):
+    loaded("articles", build_soccer_articles(tmp_path, [tagged_article("a")]))
+    first = client.get("/player_mentions", params={"player": "Pukki"})
+
+    # a tagger running /update commits to the same index files
+    mentions = index_utils.MentionIndex(str(tmp_path / "mentions.db"))
+    mentions.add_article(tagged_article("b"))
+    mentions.commit()
+    after = client.get("/player_mentions", params={"player": "Pukki"}, headers={"If-None-Match": first.headers["ETag"]})
+
+    assert after.status_code == 200
+    assert after.headers["ETag"] != first.headers["ETag"]
+    assert [mention["article_id"] for mention in after.json()["results"]] == ["a", "b"]
+
+
+def test_cached_responses_are_rendered_again_after_a_reload_or_clear_cache(client, tmp_path, monkeypatch):
+    soccer_articles = build_soccer_articles(tmp_path, [tagged_article("a")])
+    loaded("articles", soccer_articles)
+    rendered = []
+
+    def players(teams, limit):
+        rendered.append(teams)
+        return {team: [] for team in teams}
+
+    monkeypatch.setattr(soccer_articles, "players", players)
+
+    for _ in range(2):
+        client.post("/players", json=["Norwich"])
+    assert len(rendered) == 1
+
+    loaded("articles", soccer_articles)
+    client.post("/players", json=["Norwich"])
+    assert len(rendered) == 2
+
+    assert client.get("/clear_cache").json() is True
+    client.post("/players", json=["Norwich"])
+    assert len(rendered) == 3
@@ -0,0 +1,60 @@
+import queue
+import threading
+
+import pytest
+
+from utils import batch_utils
+
+
+def test_batcher_coalesces_concurrent_items():
+    batches = []
+    release = threading.Event()
+
+    def double(items):
+        release.wait(5)
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = batch_utils.MicroBatcher("test_coalesce", double, max_batch_size=4, max_wait_ms=1000)
+    futures = [batcher.submit(i) for i in range(10)]
+    release.set()
+
+    assert [future.result(5) for future in futures] == [i * 2 for i in range(10)]
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+
+
+def test_batcher_runs_a_lone_item_after_max_wait():
+    batcher = batch_utils.MicroBatcher("test_lone", lambda items: items, max_batch_size=32, max_wait_ms=10)
+
+    assert batcher.submit("a").result(5) == "a"
+
+
+def test_batcher_refuses_items_beyond_max_queue():
+    started, release = threading.Event(), threading.Event()
+
+    def blocked(items):
+        started.set()
+        release.wait(5)
+        return items
+
+    batcher = batch_utils.MicroBatcher("test_full", blocked, max_batch_size=1, max_wait_ms=0, max_queue=1)
+    running = batcher.submit("a")
+    assert started.wait(5)
+    queued = batcher.submit("b")
+
+    with pytest.raises(queue.Full):
+        batcher.submit("c")
+    release.set()
+    assert (running.result(5), queued.result(5)) == ("a", "b")
+
+
+def test_batcher_fails_every_item_of_a_failed_batch():
+    def broken(items):
+        raise ValueError("model failed")
+
+    batcher = batch_utils.MicroBatcher("test_broken", broken, max_batch_size=2, max_wait_ms=50)
+    futures = [batcher.submit(i) for i in range(2)]
+
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(5)
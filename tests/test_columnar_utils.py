@@ -0,0 +1,59 @@
+import pytest
+
+from utils import columnar_utils
+
+pytest.importorskip("pyarrow")
+
+
+def tagged_article(article_id: str, match_date: str = "2020-02-23") -> dict:
+    return {
+        "id": article_id,
+        "match_date": match_date,
+        "home_team": "Wolves",
+        "away_team": "Norwich City",
+        "sentence_info": [
+            [
+                {"ADJ": ["easy"], "ENT": ["Wolves"]},
+                {"sentiment": {"label": "POSITIVE", "score": 0.9}},
+                {"start_char": 0, "end_char": 30},
+            ],
+            [{"ADJ": [], "ENT": []}, {"sentiment": {"label": "NEGATIVE", "score": 0.6}}, {"start_char": 31, "end_char": 50}],
+        ],
+    }
+
+
+def test_partition_values():
+    assert columnar_utils.partition_value("2020-02-23") == "2020-02"
+    assert columnar_utils.partition_value("2020-02-23", partition_by="season") == "2019-2020"
+    assert columnar_utils.partition_value("2020-08-01", partition_by="season") == "2020-2021"
+    assert columnar_utils.partition_value(None) == "unknown"
+
+
+def test_article_rows_flatten_sentences_and_tags():
+    article_row, sentence_rows, tag_rows = columnar_utils.article_rows(tagged_article("a"))
+
+    assert (article_row["id"], article_row["partition"]) == ("a", "2020-02")
+    assert [row["sentiment_label"] for row in sentence_rows] == ["POSITIVE", "NEGATIVE"]
+    assert [(row["idx"], row["tag"], row["value"]) for row in tag_rows] == [(0, "ADJ", "easy"), (0, "ENT", "Wolves")]
+
+
+def test_sink_flushes_every_row_group_and_on_close(tmp_path):
+    sink = columnar_utils.ColumnarSink(tmp_path, row_group_size=2)
+    sink.add(tagged_article("a"))
+    sink.add(tagged_article("b", match_date="2020-03-01"))
+    # a full row group is written as soon as it is complete
+    assert sorted(columnar_utils.read_table("articles", path=tmp_path)["id"]) == ["a", "b"]
+
+    sink.add(tagged_article("c"))
+    sink.close()
+
+    articles = columnar_utils.read_table("articles", path=tmp_path)
+    assert sorted(articles["id"]) == ["a", "b", "c"]
+    sentences = columnar_utils.read_table("sentences", path=tmp_path, filters=[("partition", "=", "2020-03")])
+    assert list(sentences["article_id"]) == ["b", "b"]
+
+
+def test_sink_close_without_rows_writes_nothing(tmp_path):
+    columnar_utils.ColumnarSink(tmp_path).close()
+
+    assert not (tmp_path / "articles").exists()
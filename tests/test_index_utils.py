@@ -0,0 +1,123 @@
+from conftest import build_soccer_articles, tagged_article
+from utils import index_utils
+
+
+def test_team_aliases_drop_the_suffix():
+    assert index_utils.team_aliases("Norwich City") == ["norwich city", "norwich"]
+    assert index_utils.team_aliases("Watford") == ["watford"]
+
+
+def test_team_sentiment_series_resolves_aliases(tmp_path):
+    soccer_articles = build_soccer_articles(tmp_path, [tagged_article("a")])
+
+    by_alias = soccer_articles.sentiment_series("Norwich", kind="team")
+    by_name = soccer_articles.sentiment_series("Norwich City", kind="team")
+
+    assert by_alias == by_name
+    assert by_alias == [{"bucket": "2021-03", "mean_score": 0.75, "count": 1, "positive": 1, "negative": 0}]
+
+
+def test_entity_sentiment_series_by_day(tmp_path):
+    soccer_articles = build_soccer_articles(tmp_path, [tagged_article("a"), tagged_article("b", match_date="2021-03-07")])
+
+    series = soccer_articles.sentiment_series("pukki", kind="entity", granularity="day")
+
+    assert [bucket["bucket"] for bucket in series] == ["2021-03-06", "2021-03-07"]
+
+
+def test_aggregates_add_an_article_once(tmp_path):
+    aggregates = index_utils.SentimentAggregates(str(tmp_path / "aggregates.db"))
+
+    assert aggregates.add_article(tagged_article("a")) > 0
+    assert aggregates.add_article(tagged_article("a")) == 0
+
+
+def test_data_version_changes_when_the_tagger_commits(tmp_path):
+    soccer_articles = build_soccer_articles(tmp_path, [tagged_article("a")])
+    before = soccer_articles.data_version
+    assert soccer_articles.data_version == before
+
+    # the tagger has its own connections to the same index files
+    mentions = index_utils.MentionIndex(str(tmp_path / "mentions.db"))
+    mentions.add_article(tagged_article("b"))
+    mentions.commit()
+
+    assert soccer_articles.data_version != before
+
+
+def test_mention_search_pages_with_the_cursor(tmp_path):
+    mentions = index_utils.MentionIndex(str(tmp_path / "mentions.db"))
+    for article_id in ("a", "b", "c"):
+        mentions.add_article(tagged_article(article_id))
+    mentions.commit()
+
+    first = mentions.search("Pukki", limit=2)
+    last = mentions.search("Pukki", cursor=first["next_cursor"], limit=2)
+
+    assert [mention["article_id"] for mention in first["results"]] == ["a", "b"]
+    assert [mention["article_id"] for mention in last["results"]] == ["c"]
+    assert last["next_cursor"] is None
+    assert first["results"][0] == {
+        "entity": "pukki",
+        "article_id": "a",
+        "sent_idx": 0,
+        "start_char": 12,
+        "end_char": 17,
+        "sentiment": {"label": "POSITIVE", "score": 0.75},
+    }
+
+
+def test_mention_search_finds_entities_by_a_single_word(tmp_path):
+    mentions = index_utils.MentionIndex(str(tmp_path / "mentions.db"))
+    mentions.add_article(tagged_article("a", sentences=[(["Diogo Jota"], "NEGATIVE", 0.9)]))
+    mentions.commit()
+
+    assert mentions.entities("Jota") == ["diogo jota", "jota"]
+    assert [mention["entity"] for mention in mentions.search("jota")["results"]] == ["diogo jota"]
+
+
+def norwich_season():
+    return [
+        tagged_article(
+            "a",
+            away_team="Watford",
+            match_date="2021-03-06",
+            sentences=[(["Norwich", "Pukki"], "POSITIVE", 0.75), (["Watford", "Deeney"], "NEGATIVE", 0.6)],
+            persons=["Pukki", "Deeney"],
+        ),
+        tagged_article(
+            "b",
+            away_team="Brentford",
+            match_date="2021-03-13",
+            sentences=[(["Norwich", "Pukki"], "POSITIVE", 0.8), (["Brentford", "Toney"], "POSITIVE", 0.7)],
+            persons=["Pukki", "Toney"],
+        ),
+    ]
+
+
+def test_roster_keeps_a_player_at_the_team_they_are_mentioned_with_the_most(tmp_path):
+    catalogue = index_utils.MatchCatalogue(str(tmp_path / "matches.db"))
+    catalogue.update(norwich_season())
+
+    # Pukki appears for the opponents too, but only co-occurs with Norwich
+    assert catalogue.roster("Norwich") == [{"player": "Pukki", "appearances": 2, "co_mentions": 2}]
+    assert catalogue.roster("Watford") == [{"player": "Deeney", "appearances": 1, "co_mentions": 1}]
+    assert catalogue.roster("Brentford") == [{"player": "Toney", "appearances": 1, "co_mentions": 1}]
+    assert catalogue.roster("Arsenal") == []
+
+
+def test_matches_filter_by_teams_and_date_latest_first(tmp_path):
+    catalogue = index_utils.MatchCatalogue(str(tmp_path / "matches.db"))
+    catalogue.update(norwich_season())
+
+    def ids(**filters):
+        return [match["article_id"] for match in catalogue.matches(**filters)]
+
+    assert ids() == ["b", "a"]
+    assert ids(team="Norwich") == ["b", "a"]
+    assert ids(team="watford") == ["a"]
+    assert ids(home_team="Watford") == []
+    assert ids(home_team="Norwich City", away_team="Brentford") == ["b"]
+    assert ids(match_date="2021-03-06") == ["a"]
+    assert ids(limit=1) == ["b"]
+    assert catalogue.matches(match_date="2021-03-06")[0]["players"] == ["Deeney", "Pukki"]
@@ -0,0 +1,58 @@
+import threading
+
+from utils import job_utils
+
+
+def wait_for(runner: job_utils.JobRunner, job: job_utils.Job):
+    # a single worker runs jobs in order, so the job is finished once a later no-op ran
+    runner.executor.submit(lambda: None).result(timeout=5)
+    return runner.get(job.id)
+
+
+def test_submit_returns_the_active_job_of_the_same_name():
+    runner = job_utils.JobRunner()
+    release = threading.Event()
+
+    first, created = runner.submit("tag", lambda job: release.wait(5))
+    again, created_again = runner.submit("tag", lambda job: None)
+    release.set()
+
+    assert created and not created_again
+    assert again is first
+    assert wait_for(runner, first).status == "done"
+
+
+def test_submit_starts_a_new_job_once_the_last_one_finished():
+    runner = job_utils.JobRunner()
+    first, _ = runner.submit("tag", lambda job: None)
+    wait_for(runner, first)
+
+    second, created = runner.submit("tag", lambda job: None)
+
+    assert created and second is not first
+
+
+def test_job_reports_progress_and_failures():
+    runner = job_utils.JobRunner()
+
+    def tag(job):
+        job.set_total(3)
+        job.advance(2)
+        raise ValueError("no articles")
+
+    job, _ = runner.submit("tag", tag)
+    report = wait_for(runner, job).report()
+
+    assert report["status"] == "failed"
+    assert report["error"] == "ValueError('no articles')"
+    assert (report["done"], report["total"], report["eta_secs"]) == (2, 3, None)
+
+
+def test_runner_forgets_the_oldest_finished_jobs():
+    runner = job_utils.JobRunner(max_history=2)
+    jobs = [runner.submit(f"job-{i}", lambda job: None)[0] for i in range(3)]
+    wait_for(runner, jobs[-1])
+    runner.submit("job-3", lambda job: None)
+
+    assert runner.get(jobs[0].id) is None
+    assert len(runner.jobs) <= 2
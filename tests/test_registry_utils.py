@@ -0,0 +1,41 @@
+import pytest
+
+from utils import registry_utils
+
+
+class Component:
+    load_times = {}
+
+    def __init__(self, reload: bool):
+        self.reload = reload
+
+
+def test_registry_loads_once_and_reloads_explicitly():
+    models = registry_utils.ModelRegistry({"articles": Component})
+
+    first = models.get("articles")
+    assert models.get("articles") is first
+    assert (first.reload, models.versions["articles"]) == (False, 1)
+
+    reloaded = models.reload("articles")
+    assert reloaded is not first
+    assert (reloaded.reload, models.versions["articles"]) == (True, 2)
+
+
+def test_failed_reload_keeps_serving_the_loaded_component():
+    loads = []
+
+    def flaky(reload: bool):
+        if reload:
+            raise RuntimeError("s3 is down")
+        loads.append(Component(reload))
+        return loads[-1]
+
+    models = registry_utils.ModelRegistry({"articles": flaky})
+    loaded = models.get("articles")
+
+    with pytest.raises(RuntimeError):
+        models.reload("articles")
+    assert models.get("articles") is loaded
+    assert models.status["articles"]["ready"] is True
+    assert "s3 is down" in models.status["articles"]["error"]
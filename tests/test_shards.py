@@ -0,0 +1,163 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from conftest import BUCKET
+from models.soccer_text_model import SoccerText
+from settings import settings
+from utils import data_utils
+
+TAGGED_DIR = Path("data/tagged")
+
+
+def append_articles(path: Path, article_ids):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as articles_file:
+        for article_id in article_ids:
+            articles_file.write(json.dumps({"id": article_id}) + "\n")
+
+
+def article_ids(path: Path):
+    return [article["id"] for article in data_utils.read_jsonl(path)]
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch, s3_client):
+    # shards are uploaded under their relative path, like the app does from its working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "DATA_S3_BUCKET", BUCKET)
+    return tmp_path
+
+
+def test_cut_shard_takes_only_lines_appended_since_the_last_shard(tmp_path):
+    source = tmp_path / "articles.jl"
+    append_articles(source, ["a", "b"])
+    assert data_utils.cut_shard(source, tmp_path / "tagged", "run-1.jl")["articles"] == 2
+
+    append_articles(source, ["c"])
+    with open(source, "a") as source_file:
+        source_file.write('{"id": "still being wri')
+    shard = data_utils.cut_shard(source, tmp_path / "tagged", "run-2.jl")
+
+    assert shard["articles"] == 1
+    assert article_ids(tmp_path / "tagged" / "run-2.jl") == ["c"]
+    assert data_utils.cut_shard(source, tmp_path / "tagged", "run-3.jl") is None
+    manifest = data_utils.load_shard_manifest(tmp_path / "tagged")
+    assert [shard["name"] for shard in manifest["shards"]] == ["run-1.jl", "run-2.jl"]
+
+
+def test_cut_shard_ignores_an_offset_synced_from_another_host(tmp_path):
+    folder = tmp_path / "tagged"
+    folder.mkdir()
+    # the manifest of a host with a longer articles.jl, as downloaded from s3
+    (folder / "run-0.jl").write_text(json.dumps({"id": "x", "x": "y" * 100}) + "\n")
+    manifest = {"published_to": 10_000, "shards": [{"name": "run-0.jl", "articles": 1, "bytes": 115}]}
+    (folder / data_utils.SHARD_MANIFEST).write_text(json.dumps(manifest))
+    append_articles(tmp_path / "articles.jl", ["a", "b"])
+
+    assert data_utils.cut_shard(tmp_path / "articles.jl", folder, "run-1.jl")["articles"] == 2
+    assert article_ids(folder / "run-1.jl") == ["a", "b"]
+
+    # the local offset is kept apart from the manifest, s3 overwriting it again changes nothing
+    (folder / data_utils.SHARD_MANIFEST).write_text(json.dumps(manifest))
+    append_articles(tmp_path / "articles.jl", ["c"])
+    assert article_ids(folder / data_utils.cut_shard(tmp_path / "articles.jl", folder, "run-2.jl")["name"]) == ["c"]
+
+
+def test_cut_shard_starts_over_on_a_replaced_source(tmp_path):
+    source = tmp_path / "articles.jl"
+    append_articles(source, ["a", "b", "c"])
+    data_utils.cut_shard(source, tmp_path / "tagged", "run-1.jl")
+
+    source.unlink()
+    append_articles(source, ["d"])
+
+    assert data_utils.cut_shard(source, tmp_path / "tagged", "run-2.jl")["articles"] == 1
+    assert article_ids(tmp_path / "tagged" / "run-2.jl") == ["d"]
+
+
+def test_cut_shard_continues_from_a_manifest_written_before_local_offsets(tmp_path):
+    source, folder = tmp_path / "articles.jl", tmp_path / "tagged"
+    append_articles(source, ["a"])
+    folder.mkdir()
+    (folder / "run-1.jl").write_bytes(source.read_bytes())
+    manifest = {"published_to": source.stat().st_size, "shards": [{"name": "run-1.jl", "articles": 1}]}
+    (folder / data_utils.SHARD_MANIFEST).write_text(json.dumps(manifest))
+    append_articles(source, ["b"])
+
+    assert article_ids(folder / data_utils.cut_shard(source, folder, "run-2.jl")["name"]) == ["b"]
+
+
+def test_append_shards_leaves_a_target_alone_without_shards(tmp_path):
+    target = tmp_path / "articles.jl"
+    append_articles(target, ["a", "b"])
+
+    assert data_utils.append_shards(tmp_path / "tagged", target) == []
+    assert article_ids(target) == ["a", "b"]
+
+
+def test_append_shards_records_the_shards_a_target_already_holds(tmp_path):
+    source, target = tmp_path / "articles.jl", tmp_path / "copy.jl"
+    append_articles(source, ["a"])
+    data_utils.cut_shard(source, tmp_path / "tagged", "run-1.jl")
+    target.write_bytes(source.read_bytes())
+    append_articles(source, ["b"])
+    data_utils.cut_shard(source, tmp_path / "tagged", "run-2.jl")
+
+    assert data_utils.append_shards(tmp_path / "tagged", target) == ["run-2.jl"]
+    assert article_ids(target) == ["a", "b"]
+
+
+def test_append_shards_rebuilds_a_target_holding_something_else(tmp_path):
+    source, target = tmp_path / "articles.jl", tmp_path / "copy.jl"
+    append_articles(source, ["a", "b"])
+    data_utils.cut_shard(source, tmp_path / "tagged", "run-1.jl")
+    append_articles(target, ["stale"])
+
+    assert data_utils.append_shards(tmp_path / "tagged", target) == ["run-1.jl"]
+    assert article_ids(target) == ["a", "b"]
+    assert data_utils.append_shards(tmp_path / "tagged", target) == []
+
+
+def test_upload_shards_uploads_only_missing_shards(workdir, s3_client):
+    tagger = SoccerText(s3_client)
+    append_articles(Path("data/articles.jl"), ["a"])
+    data_utils.cut_shard(Path("data/articles.jl"), TAGGED_DIR, "run-1.jl")
+    assert tagger.upload_shards(TAGGED_DIR) == ["run-1.jl"]
+
+    append_articles(Path("data/articles.jl"), ["b"])
+    data_utils.cut_shard(Path("data/articles.jl"), TAGGED_DIR, "run-2.jl")
+
+    assert tagger.upload_shards(TAGGED_DIR) == ["run-2.jl"]
+    remote = data_utils.list_objects(str(TAGGED_DIR), BUCKET, s3_client)
+    assert sorted(remote) == ["data/tagged/manifest.json", "data/tagged/run-1.jl", "data/tagged/run-2.jl"]
+
+
+def test_shards_round_trip_through_s3_to_a_reader(workdir, s3_client, tmp_path_factory):
+    tagger = SoccerText(s3_client)
+    reader_dir = tmp_path_factory.mktemp("reader")
+    for run, new_ids in enumerate([["a", "b"], ["c"], ["d"]]):
+        append_articles(Path("data/articles.jl"), new_ids)
+        data_utils.cut_shard(Path("data/articles.jl"), TAGGED_DIR, f"run-{run}.jl")
+        tagger.upload_shards(TAGGED_DIR)
+
+        data_utils.sync_dir(str(TAGGED_DIR), reader_dir / "tagged", BUCKET, s3_client)
+        data_utils.append_shards(reader_dir / "tagged", reader_dir / "tagged" / "articles.jl")
+
+    assert article_ids(reader_dir / "tagged" / "articles.jl") == ["a", "b", "c", "d"]
+
+
+def test_reader_on_the_tagger_node_never_republishes_articles(workdir, s3_client):
+    # the reader appends to its own file in the shard folder, the tagger cuts shards from data/articles.jl
+    tagger = SoccerText(s3_client)
+    reader_target = TAGGED_DIR / "articles.jl"
+    for run, new_ids in enumerate([["a", "b"], ["c"], ["d"]]):
+        append_articles(Path("data/articles.jl"), new_ids)
+        data_utils.cut_shard(Path("data/articles.jl"), TAGGED_DIR, f"run-{run}.jl")
+        tagger.upload_shards(TAGGED_DIR)
+        data_utils.append_shards(TAGGED_DIR, reader_target)
+
+    assert article_ids(Path("data/articles.jl")) == ["a", "b", "c", "d"]
+    assert article_ids(reader_target) == ["a", "b", "c", "d"]
+    assert article_ids(TAGGED_DIR / "run-2.jl") == ["d"]
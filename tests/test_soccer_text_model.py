@@ -0,0 +1,61 @@
+import jmespath
+import pytest
+from cachetools.keys import hashkey
+
+from conftest import build_soccer_articles, tagged_article
+from models.soccer_text_model import compile_query
+
+PUKKI = "entity_labels.PERSON[?@ == 'Pukki']"
+
+
+def three_matches():
+    return [
+        tagged_article("a", away_team="Watford", match_date="2021-03-06"),
+        tagged_article("b", away_team="Brentford", match_date="2021-03-13"),
+        tagged_article(
+            "c",
+            home_team="Arsenal",
+            away_team="Leeds United",
+            match_date="2021-03-14",
+            sentences=[(["Saka"], "POSITIVE", 0.9)],
+            persons=["Saka"],
+        ),
+    ]
+
+
+def test_compile_query_caches_valid_expressions_only():
+    assert compile_query(PUKKI) is compile_query(PUKKI)
+    assert hashkey(PUKKI) in compile_query.cache
+
+    with pytest.raises(jmespath.exceptions.ParseError):
+        compile_query("[?")
+    assert hashkey("[?") not in compile_query.cache
+
+
+def test_query_keeps_articles_with_a_result_and_pages_with_the_cursor(tmp_path):
+    soccer_articles = build_soccer_articles(tmp_path, three_matches())
+
+    first = soccer_articles.query(PUKKI, limit=1)
+    second = soccer_articles.query(PUKKI, cursor=first["next_cursor"], limit=1)
+    last = soccer_articles.query(PUKKI, cursor=second["next_cursor"], limit=1)
+
+    assert first["results"] == [{"article_id": "a", "value": ["Pukki"]}]
+    assert [result["article_id"] for result in second["results"]] == ["b"]
+    assert last == {"results": [], "next_cursor": None}
+
+
+def test_query_only_reads_the_articles_of_matching_games(tmp_path, monkeypatch):
+    soccer_articles = build_soccer_articles(tmp_path, three_matches())
+    store_get = soccer_articles.store.get
+    read = []
+
+    def get(i):
+        read.append(soccer_articles.store.article_ids[i])
+        return store_get(i)
+
+    monkeypatch.setattr(soccer_articles.store, "get", get)
+
+    assert [result["article_id"] for result in soccer_articles.query("id", team="Arsenal")["results"]] == ["c"]
+    assert read == ["c"]
+    assert [result["article_id"] for result in soccer_articles.query("id", start="2021-03-07", end="2021-03-13")["results"]] == ["b"]
+    assert [result["article_id"] for result in soccer_articles.query("id", team="Norwich", end="2021-03-06")["results"]] == ["a"]
@@ -0,0 +1,57 @@
+import json
+
+from utils import store_utils
+
+
+def write_articles(path, articles):
+    path.write_text("".join(json.dumps(article) + "\n" for article in articles))
+
+
+def article(article_id: str, text: str) -> dict:
+    return {
+        "id": article_id,
+        "home_team": "Wolves",
+        "away_team": "Burnley",
+        "text": text,
+        "pictures": {"src": "https://example.com"},
+        "entity_labels": {"PERSON": ["Neto"]},
+        "sentence_info": [[{"ENT": ["Neto"]}, {"sentiment": {"label": "POSITIVE", "score": 0.5}}, {"start_char": 0, "end_char": 5}]],
+    }
+
+
+def test_store_round_trips_articles(tmp_path):
+    articles = [article("a", "Wolves won."), article("b", "Burnley lost.")]
+    write_articles(tmp_path / "articles.jl", articles)
+
+    store = store_utils.ArticleStore(tmp_path / "articles.jl", tmp_path / "store")
+    store.refresh()
+
+    assert [store.get(i) for i in store.rows()] == articles
+
+
+def test_store_loads_saved_columns_and_parses_only_new_lines(tmp_path):
+    write_articles(tmp_path / "articles.jl", [article("a", "Wolves won.")])
+    store_utils.ArticleStore(tmp_path / "articles.jl", tmp_path / "store").refresh()
+    with open(tmp_path / "articles.jl", "a") as articles_file:
+        articles_file.write(json.dumps(article("b", "Burnley lost.")) + "\n")
+
+    store = store_utils.ArticleStore(tmp_path / "articles.jl", tmp_path / "store")
+
+    assert store.refresh() == 1
+    assert [store.get(i)["text"] for i in store.rows()] == ["Wolves won.", "Burnley lost."]
+
+
+def test_rebuild_keeps_the_serving_store_readable(tmp_path):
+    write_articles(tmp_path / "articles.jl", [article("a", "Wolves won.")])
+    serving = store_utils.ArticleStore(tmp_path / "articles.jl", tmp_path / "store")
+    serving.refresh()
+    assert serving.get(0)["text"] == "Wolves won."
+
+    # replaced file, the new store rebuilds while the first one still serves
+    write_articles(tmp_path / "articles.jl", [article("c", "A different report, and a longer one.")])
+    rebuilt = store_utils.ArticleStore(tmp_path / "articles.jl", tmp_path / "store")
+    rebuilt.refresh()
+
+    assert rebuilt.get(0)["text"] == "A different report, and a longer one."
+    assert serving.get(0)["text"] == "Wolves won."
+    assert sorted(path.name for path in (tmp_path / "store").glob("*.blob")) == ["extras-2.blob", "texts-2.blob"]
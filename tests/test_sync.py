@@ -0,0 +1,122 @@
+import json
+from datetime import timedelta
+from pathlib import Path
+
+from conftest import BUCKET
+from models.soccer_text_model import SoccerText
+from settings import settings
+from utils import data_utils
+
+
+def put(s3_client, key: str, body: str):
+    s3_client.put_object(Bucket=BUCKET, Key=key, Body=body.encode("utf-8"))
+
+
+def test_sync_dir_downloads_everything_first(s3_client, tmp_path):
+    put(s3_client, "reports/a.json", '{"id": "a"}')
+    put(s3_client, "reports/b.json", '{"id": "b"}')
+
+    changed, removed = data_utils.sync_dir("reports", tmp_path / "reports", BUCKET, s3_client)
+
+    assert sorted(path.name for path in changed) == ["a.json", "b.json"]
+    assert removed == []
+    assert (tmp_path / "reports" / "a.json").read_text() == '{"id": "a"}'
+
+
+def test_sync_dir_only_downloads_new_and_changed(s3_client, tmp_path):
+    put(s3_client, "reports/a.json", '{"id": "a"}')
+    put(s3_client, "reports/b.json", '{"id": "b"}')
+    data_utils.sync_dir("reports", tmp_path / "reports", BUCKET, s3_client)
+
+    put(s3_client, "reports/b.json", '{"id": "b", "text": "changed"}')
+    put(s3_client, "reports/c.json", '{"id": "c"}')
+    changed, _ = data_utils.sync_dir("reports", tmp_path / "reports", BUCKET, s3_client)
+
+    assert sorted(path.name for path in changed) == ["b.json", "c.json"]
+    assert json.loads((tmp_path / "reports" / "b.json").read_text())["text"] == "changed"
+
+    changed, _ = data_utils.sync_dir("reports", tmp_path / "reports", BUCKET, s3_client)
+    assert changed == []
+
+
+def test_sync_dir_downloads_missing_local_copies_again(s3_client, tmp_path):
+    put(s3_client, "reports/a.json", '{"id": "a"}')
+    data_utils.sync_dir("reports", tmp_path / "reports", BUCKET, s3_client)
+
+    (tmp_path / "reports" / "a.json").unlink()
+    changed, _ = data_utils.sync_dir("reports", tmp_path / "reports", BUCKET, s3_client)
+
+    assert [path.name for path in changed] == ["a.json"]
+
+
+def test_sync_dir_deletes_objects_removed_from_s3(s3_client, tmp_path):
+    put(s3_client, "reports/a.json", '{"id": "a"}')
+    put(s3_client, "reports/b.json", '{"id": "b"}')
+    data_utils.sync_dir("reports", tmp_path / "reports", BUCKET, s3_client)
+
+    s3_client.delete_object(Bucket=BUCKET, Key="reports/a.json")
+    changed, removed = data_utils.sync_dir("reports", tmp_path / "reports", BUCKET, s3_client)
+
+    assert changed == []
+    assert removed == [tmp_path / "reports" / "a.json"]
+    assert not (tmp_path / "reports" / "a.json").exists()
+    assert (tmp_path / "reports" / "b.json").exists()
+
+
+def test_sync_dir_only_flags_removed_objects_without_delete(s3_client, tmp_path):
+    put(s3_client, "reports/a.json", '{"id": "a"}')
+    data_utils.sync_dir("reports", tmp_path / "reports", BUCKET, s3_client)
+
+    s3_client.delete_object(Bucket=BUCKET, Key="reports/a.json")
+    _, removed = data_utils.sync_dir("reports", tmp_path / "reports", BUCKET, s3_client, delete=False)
+
+    assert removed == [tmp_path / "reports" / "a.json"]
+    assert (tmp_path / "reports" / "a.json").exists()
+    manifest = json.loads((tmp_path / ".reports.manifest.json").read_text())
+    assert manifest["objects"]["reports/a.json"]["Removed"] is True
+
+
+def test_sync_dir_manifest_records_synced_objects(s3_client, tmp_path):
+    put(s3_client, "reports/a.json", '{"id": "a"}')
+    manifest_path = tmp_path / "manifest.json"
+
+    data_utils.sync_dir("reports", tmp_path / "reports", BUCKET, s3_client, manifest_path=manifest_path)
+
+    manifest = json.loads(manifest_path.read_text())
+    assert manifest["synced_at"] is not None
+    assert set(manifest["objects"]) == {"reports/a.json"}
+    assert set(manifest["objects"]["reports/a.json"]) == {"ETag", "Size", "LastModified"}
+
+
+def test_sync_dir_skips_listing_within_min_interval(s3_client, tmp_path):
+    put(s3_client, "reports/a.json", '{"id": "a"}')
+    data_utils.sync_dir("reports", tmp_path / "reports", BUCKET, s3_client)
+
+    put(s3_client, "reports/b.json", '{"id": "b"}')
+    changed, _ = data_utils.sync_dir("reports", tmp_path / "reports", BUCKET, s3_client, min_interval=timedelta(hours=1))
+
+    assert changed == []
+    assert not (tmp_path / "reports" / "b.json").exists()
+
+
+def test_sync_dir_syncs_a_single_object_into_a_file(s3_client, tmp_path):
+    put(s3_client, "data/articles.jl", '{"id": "a"}\n')
+
+    changed, _ = data_utils.sync_dir("data/articles.jl", tmp_path / "articles.jl", BUCKET, s3_client)
+
+    assert changed == [tmp_path / "articles.jl"]
+    assert (tmp_path / "articles.jl").read_text() == '{"id": "a"}\n'
+
+
+def test_forced_sync_data_lists_s3_within_the_update_frequency(s3_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DATA_S3_BUCKET", BUCKET)
+    soccer_text = SoccerText(s3_client)
+    put(s3_client, "reports/a.json", '{"id": "a"}')
+    soccer_text.sync_data(s3_folder=Path("reports"), local=tmp_path / "reports", ingest=False)
+    put(s3_client, "reports/b.json", '{"id": "b"}')
+
+    changed, _ = soccer_text.sync_data(s3_folder=Path("reports"), local=tmp_path / "reports", ingest=False)
+    assert changed == []
+
+    changed, _ = soccer_text.sync_data(s3_folder=Path("reports"), local=tmp_path / "reports", ingest=False, force=True)
+    assert changed == [tmp_path / "reports" / "b.json"]